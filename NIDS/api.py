@@ -1,16 +1,27 @@
-from fastapi import FastAPI, Depends, HTTPException, Security
+from fastapi import FastAPI, Depends, HTTPException, Security, Request, Query, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from contextlib import asynccontextmanager, contextmanager
+from pydantic import BaseModel
+import asyncio
+import csv
+import io
 import psycopg2
+import psycopg2.pool
+from psycopg2 import sql
 import requests
+import threading
+import time
 import uvicorn
 import json
 import jwt
 import os
 from datetime import datetime, timezone, timedelta
+from typing import List, Optional
 from passlib.context import CryptContext
 
-app = FastAPI()
 #NIDS_URL = "http://nids:5050"
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
@@ -18,6 +29,52 @@ DB_NAME = os.getenv("DB_NAME", "nids_db")
 DB_USER = os.getenv("DB_USER", "user")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
 
+# Pool de conexões compartilhado por todos os endpoints do processo
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 2))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# Conexões ociosas há mais tempo que isso passam por um "SELECT 1" antes de serem reutilizadas
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", 30))
+# Tempo máximo de espera por uma conexão livre quando o pool está cheio
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+
+# Inserção em massa: linhas por COPY e quantidade máxima de rejeições detalhadas na resposta
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 5000))
+BULK_MAX_REJEITADOS = int(os.getenv("BULK_MAX_REJEITADOS", 1000))
+
+COLUNAS_TRAFEGO = [
+    "flow_id", "src_ip", "dest_ip", "src_port", "dest_port", "proto",
+    "hour", "minute", "seconds", "severity",
+    "pkts_toserver", "pkts_toclient", "bytes_toserver", "bytes_toclient"
+]
+COLUNAS_CLASSIFICADOS = COLUNAS_TRAFEGO + ["class", "processado"]
+COLUNAS_TEXTO = {"flow_id", "src_ip", "dest_ip", "proto", "class"}
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+# Consultas paginadas: tamanho padrão/máximo da página e linhas por ida ao banco no modo streaming
+PAGINA_PADRAO = int(os.getenv("PAGINA_PADRAO", 1000))
+PAGINA_MAXIMA = int(os.getenv("PAGINA_MAXIMA", 10000))
+STREAM_ITERSIZE = int(os.getenv("STREAM_ITERSIZE", 2000))
+TABELAS_CONSULTA = {"trafego", "classificados"}
+
+# Classificação síncrona (/classificar): requisições concorrentes são agrupadas por até
+# CLASSIFICAR_JANELA_MS ou CLASSIFICAR_MAX_LOTE fluxos antes de chamar o modelo. Desligada por padrão:
+# cada worker carrega o TensorFlow e o modelo, que precisa dos artefatos de pré-processamento do treino
+CLASSIFICAR_HABILITADO = os.getenv("CLASSIFICAR_HABILITADO", "0") == "1"
+CLASSIFICAR_JANELA_MS = float(os.getenv("CLASSIFICAR_JANELA_MS", 5))
+CLASSIFICAR_MAX_LOTE = int(os.getenv("CLASSIFICAR_MAX_LOTE", 2048))
+CLASSIFICAR_LIMIAR = float(os.getenv("CLASSIFICAR_LIMIAR", 0.7))
+MODEL_PATH = os.getenv("MODEL_PATH", "/models/flower-uiot.keras")
+
+# Reserva de ataques (/dados/ataques/reservar): por quanto tempo, em segundos, uma linha reservada
+# fica invisível para os outros consumidores antes de poder ser reservada de novo
+RESERVA_DURACAO = int(os.getenv("RESERVA_DURACAO", 900))
+RESERVA_DURACAO_MAXIMA = int(os.getenv("RESERVA_DURACAO_MAXIMA", 7200))
+
+# Eventos de novos ataques (/dados/ataques/eventos): canal do NOTIFY disparado pelo trigger em
+# classificados e intervalo dos comentários de keep-alive enviados aos assinantes
+CANAL_ATAQUES = "classificados_novos"
+EVENTOS_HEARTBEAT = float(os.getenv("EVENTOS_HEARTBEAT", 15))
+
 # Configuração do JWT
 SECRET_KEY = "seu_segredo_super_secreto"
 ALGORITHM = "HS256"
@@ -38,6 +95,316 @@ def conectar():
         password=DB_PASSWORD
     )
 
+
+class PoolConexoes:
+    """
+    ThreadedConnectionPool com limite de espera e verificação de saúde.
+    Os endpoints síncronos rodam no threadpool do FastAPI, então o acesso precisa ser thread-safe.
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        # Criado no primeiro uso: sob o supervisord a API sobe antes do PostgreSQL aceitar conexões
+        self.pool = None
+        self.trava = threading.Lock()
+        # Bloqueia quando o pool está esgotado, em vez do PoolError imediato do psycopg2
+        self.vagas = threading.BoundedSemaphore(maxconn)
+        self.ultimo_uso = {}
+
+    def _abrir(self):
+        with self.trava:
+            if self.pool is None:
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    self.minconn, self.maxconn,
+                    host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD
+                )
+                print(f"[API] Pool de conexões aberto (min={self.minconn}, max={self.maxconn}).")
+            return self.pool
+
+    def _saudavel(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self.ultimo_uso.get(id(conn), 0) < DB_POOL_HEALTHCHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def obter(self):
+        if not self.vagas.acquire(timeout=DB_POOL_TIMEOUT):
+            raise HTTPException(status_code=503, detail="Banco de dados ocupado, tente novamente")
+        try:
+            pool = self._abrir()
+            conn = pool.getconn()
+            descartadas = 0
+            # A substituta também é verificada: várias conexões ociosas podem ter caído juntas
+            while not self._saudavel(conn):
+                pool.putconn(conn, close=True)
+                descartadas += 1
+                if descartadas > pool.maxconn:
+                    raise HTTPException(status_code=503, detail="Banco de dados indisponível")
+                conn = pool.getconn()
+            return conn
+        except psycopg2.OperationalError as e:
+            # Banco fora do ar ou ainda iniciando: o pool é aberto de novo na próxima requisição
+            self.vagas.release()
+            raise HTTPException(status_code=503, detail=f"Banco de dados indisponível: {e}")
+        except Exception:
+            self.vagas.release()
+            raise
+
+    def devolver(self, conn, descartar=False):
+        try:
+            # Nenhuma conexão volta ao pool com transação aberta: o próximo commit() gravaria o resto dela
+            if not descartar and not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    descartar = True
+            self.ultimo_uso[id(conn)] = time.monotonic()
+            self.pool.putconn(conn, close=descartar or conn.closed)
+        finally:
+            self.vagas.release()
+
+    def fechar(self):
+        if self.pool is not None:
+            self.pool.closeall()
+
+
+class AgrupadorInferencia:
+    """
+    Fila única para o modelo: cada requisição entrega seus fluxos e aguarda um future.
+    O laço junta o que chegar dentro da janela em um micro-lote, roda a inferência fora
+    do event loop e devolve a fatia de resultados de cada requisição.
+    """
+
+    def __init__(self, modelo, janela_ms=CLASSIFICAR_JANELA_MS, max_lote=CLASSIFICAR_MAX_LOTE):
+        self.modelo = modelo
+        self.janela = janela_ms / 1000
+        self.max_lote = max_lote
+        self.fila = asyncio.Queue()
+        self.tarefa = None
+        self.ultima_verificacao = 0.0
+
+    def iniciar(self):
+        self.tarefa = asyncio.create_task(self._laco())
+
+    async def parar(self):
+        if self.tarefa is not None:
+            self.tarefa.cancel()
+            try:
+                await self.tarefa
+            except asyncio.CancelledError:
+                pass
+
+    async def classificar(self, df):
+        futuro = asyncio.get_running_loop().create_future()
+        await self.fila.put((df, futuro))
+        return await futuro
+
+    def _inferir(self, lote):
+        # Verifica no máximo a cada 30s se o arquivo do modelo mudou
+        if time.monotonic() - self.ultima_verificacao > 30:
+            self.ultima_verificacao = time.monotonic()
+            self.modelo.reload_if_changed()
+        return self.modelo.classify(lote, CLASSIFICAR_LIMIAR)
+
+    async def _laco(self):
+        import pandas as pd
+
+        loop = asyncio.get_running_loop()
+        while True:
+            pendentes = [await self.fila.get()]
+            total = len(pendentes[0][0])
+            prazo = loop.time() + self.janela
+            while total < self.max_lote:
+                restante = prazo - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.fila.get(), restante)
+                except asyncio.TimeoutError:
+                    break
+                pendentes.append(item)
+                total += len(item[0])
+
+            try:
+                lote = pd.concat([df for df, _ in pendentes], ignore_index=True)
+                classes, confiancas = await run_in_threadpool(self._inferir, lote)
+            except Exception as e:
+                for _, futuro in pendentes:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                continue
+
+            inicio = 0
+            for df, futuro in pendentes:
+                fim = inicio + len(df)
+                if not futuro.done():
+                    futuro.set_result((classes[inicio:fim], confiancas[inicio:fim]))
+                inicio = fim
+
+
+class NotificadorAtaques:
+    """
+    LISTEN em uma conexão dedicada (fora do pool), integrada ao event loop com add_reader.
+    Cada NOTIFY é repassado a todos os assinantes; a fila de cada um guarda só o aviso mais
+    recente, já que o assinante busca tudo o que estiver pendente ao ser acordado.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.assinantes = set()
+        self.tarefa = None
+
+    def iniciar(self):
+        self.tarefa = asyncio.create_task(self._conectar())
+
+    async def parar(self):
+        if self.tarefa is not None:
+            self.tarefa.cancel()
+            try:
+                await self.tarefa
+            except asyncio.CancelledError:
+                pass
+        self._desconectar()
+
+    def assinar(self):
+        fila = asyncio.Queue(maxsize=1)
+        self.assinantes.add(fila)
+        return fila
+
+    def cancelar(self, fila):
+        self.assinantes.discard(fila)
+
+    async def _conectar(self):
+        espera = 1
+        while True:
+            try:
+                conn = await run_in_threadpool(conectar)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CANAL_ATAQUES}")
+                self.conn = conn
+                asyncio.get_running_loop().add_reader(conn.fileno(), self._receber)
+                print(f"[API] Escutando o canal {CANAL_ATAQUES}.")
+                return
+            except psycopg2.Error as e:
+                print(f"[API] LISTEN indisponível, nova tentativa em {espera}s: {e}")
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, 60)
+
+    def _desconectar(self):
+        if self.conn is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self.conn.fileno())
+            except (ValueError, psycopg2.Error):
+                pass
+            if not self.conn.closed:
+                self.conn.close()
+            self.conn = None
+
+    def _receber(self):
+        try:
+            self.conn.poll()
+        except psycopg2.Error as e:
+            print(f"[API] Conexão do LISTEN perdida: {e}")
+            self._desconectar()
+            # Avisa os assinantes para que busquem o que possa ter chegado durante a queda
+            self._publicar({"reconectado": True})
+            self.tarefa = asyncio.create_task(self._conectar())
+            return
+
+        # poll() também acorda sem NOTIFY (ex.: mensagens do servidor); só publica se algo chegou
+        avisos, total = 0, 0
+        while self.conn.notifies:
+            aviso = self.conn.notifies.pop(0)
+            avisos += 1
+            total += int(aviso.payload) if aviso.payload.isdigit() else 0
+        if avisos:
+            self._publicar({"novos": total})
+
+    def _publicar(self, evento):
+        for fila in self.assinantes:
+            if fila.full():
+                fila.get_nowait()
+            fila.put_nowait(evento)
+
+
+pool = None
+agrupador = None
+notificador = None
+
+
+@contextmanager
+def obter_conexao():
+    """Empresta uma conexão do pool; desfaz a transação em caso de erro e devolve a conexão ao final"""
+    conn = pool.obter()
+    descartar = False
+    try:
+        yield conn
+    except BaseException:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            descartar = True
+        raise
+    finally:
+        pool.devolver(conn, descartar=descartar)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Cria o pool (aberto no primeiro uso) na inicialização do worker e o fecha no desligamento"""
+    global pool, agrupador, notificador
+    if CLASSIFICAR_HABILITADO:
+        # Verificado antes de carregar o TensorFlow: sem os artefatos o modelo não serve para a API
+        import classifier
+        artefatos = classifier.preprocessing_path_for(MODEL_PATH)
+        if not os.path.exists(artefatos):
+            raise RuntimeError(
+                f"[API] CLASSIFICAR_HABILITADO=1, mas {artefatos} não existe: exporte o modelo treinado "
+                "(server.py) ou desabilite a classificação pela API"
+            )
+
+    pool = PoolConexoes()
+    app.state.db_pool = pool
+
+    notificador = NotificadorAtaques()
+    notificador.iniciar()
+
+    if CLASSIFICAR_HABILITADO:
+        try:
+            # Import tardio: o TensorFlow só é carregado quando a classificação pela API está habilitada
+            import classifier
+            modelo = classifier.NIDSModel(MODEL_PATH)
+            await run_in_threadpool(modelo.load)
+            agrupador = AgrupadorInferencia(modelo)
+            agrupador.iniciar()
+            print(f"[API] Classificação por micro-lotes habilitada (janela={CLASSIFICAR_JANELA_MS}ms).")
+        except Exception as e:
+            print(f"[API] Classificação pela API indisponível: {e}")
+
+    try:
+        yield
+    finally:
+        if agrupador is not None:
+            await agrupador.parar()
+            agrupador = None
+        await notificador.parar()
+        notificador = None
+        pool.fechar()
+        pool = None
+        print("[API] Pool de conexões encerrado.")
+
+
+app = FastAPI(lifespan=lifespan)
+
 # Criar token JWT
 def criar_token_jwt(dados: dict, expira_em: int = ACCESS_TOKEN_EXPIRE_MINUTES):
     dados_copia = dados.copy()
@@ -61,21 +428,20 @@ def verificar_token_jwt(credentials: HTTPAuthorizationCredentials = Security(oau
 
 # Executar query no banco
 def executar_query(query, params=(), fetchall=False, fetchone=False):
-    conn = conectar()
-    cursor = conn.cursor()
-    
-    cursor.execute(query, params)
-    conn.commit()
-
-    if fetchall:
-        resultado = cursor.fetchall()
-    elif fetchone:
-        resultado = cursor.fetchone()
-    else:
-        resultado = None
+    with obter_conexao() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(query, params)
+
+        if fetchall:
+            resultado = cursor.fetchall()
+        elif fetchone:
+            resultado = cursor.fetchone()
+        else:
+            resultado = None
 
-    cursor.close()
-    conn.close()
+        conn.commit()
+        cursor.close()
     return resultado
 
 
@@ -92,7 +458,7 @@ def registrar_usuario(username: str, password: str):
     return {"mensagem": "Usuário registrado com sucesso!"}
 
 @app.post("/token")
-async def gerar_token(form_data: OAuth2PasswordRequestForm = Depends()):
+def gerar_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """Gera um token JWT para um usuário autenticado"""
     usuario = form_data.username
     senha = form_data.password
@@ -107,18 +473,48 @@ async def gerar_token(form_data: OAuth2PasswordRequestForm = Depends()):
     return {"access_token": token, "token_type": "bearer"}
 
 
+def transmitir_ndjson(query, params=()):
+    """Gera uma linha NDJSON por registro usando um cursor no servidor (memória constante)"""
+    with obter_conexao() as conn:
+        with conn.cursor(name="stream_dados") as cursor:
+            cursor.itersize = STREAM_ITERSIZE
+            cursor.execute(query, params)
+            for linha in cursor:
+                yield json.dumps(linha, default=str) + "\n"
+
+def consultar_pagina(query, after_id: int, limit: Optional[int], stream: bool):
+    """
+    Paginação por chave (id > after_id ORDER BY id). No modo stream devolve NDJSON;
+    caso contrário devolve uma página e o after_id da próxima.
+    """
+    if stream:
+        # Sem limit, LIMIT NULL transmite a tabela inteira a partir de after_id
+        return StreamingResponse(transmitir_ndjson(query, (after_id, limit)), media_type="application/x-ndjson")
+
+    limit = limit or PAGINA_PADRAO
+    dados = executar_query(query, (after_id, limit), fetchall=True)
+    proximo = dados[-1][0] if len(dados) == limit else None
+    return {"dados": dados, "proximo_after_id": proximo}
+
 @app.get("/dados")
-def obter_dados(tabela, token: dict = Depends(verificar_token_jwt)):
+def obter_dados(tabela, after_id: int = 0, limit: Optional[int] = Query(None, ge=1, le=PAGINA_MAXIMA),
+                stream: bool = False, token: dict = Depends(verificar_token_jwt)):
+    if tabela not in TABELAS_CONSULTA:
+        raise HTTPException(status_code=400, detail=f"Tabela inválida: {tabela}")
     try:
-        dados = executar_query(query=f"SELECT * FROM {tabela}")
-        return {"dados": dados}
+        query = sql.SQL("SELECT * FROM {} WHERE id > %s ORDER BY id LIMIT %s").format(sql.Identifier(tabela))
+        return consultar_pagina(query, after_id, limit, stream)
+    except HTTPException:
+        # Ex.: 503 do pool quando o banco está indisponível ou ocupado
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao obter dados: {str(e)}")
 
 @app.get("/dados/ataques")
-def obter_dados_ataques(token: dict = Depends(verificar_token_jwt)):
-    dados = executar_query(query = "SELECT * FROM classificados WHERE class NOT IN ('normal', 'Benign')")
-    return {"dados": dados}
+def obter_dados_ataques(after_id: int = 0, limit: Optional[int] = Query(None, ge=1, le=PAGINA_MAXIMA),
+                        stream: bool = False, token: dict = Depends(verificar_token_jwt)):
+    query = "SELECT * FROM classificados WHERE class NOT IN ('normal', 'Benign') AND id > %s ORDER BY id LIMIT %s"
+    return consultar_pagina(query, after_id, limit, stream)
 
 @app.get("/dados/trafego/insert")
 def inserir_dados(flow_id: str, src_ip: str, dest_ip: str, src_port: int, dest_port: int, proto: str, hour: int, 
@@ -136,11 +532,245 @@ def inserir_dados(flow_id: str, src_ip: str, dest_ip: str, src_port: int, dest_p
     if executar_query(query, (flow_id, src_ip, dest_ip, src_port, dest_port, proto, hour, minute, seconds, severity, pkts_toserver, pkts_toclient, bytes_toserver, bytes_toclient, classe, processado)):
         return {"mensagem": "Dados inseridos com sucesso!"}
 
+def validar_registro(registro, colunas):
+    """Converte um registro (objeto ou lista na ordem das colunas) em uma tupla pronta para o COPY"""
+    if isinstance(registro, dict):
+        if "class" not in registro and "classe" in registro:
+            registro = {**registro, "class": registro["classe"]}
+        valores = [registro.get(coluna) for coluna in colunas]
+    elif isinstance(registro, list):
+        if len(registro) != len(colunas):
+            raise ValueError(f"Esperados {len(colunas)} campos, recebidos {len(registro)}")
+        valores = registro
+    else:
+        raise ValueError("Registro deve ser um objeto ou uma lista")
+
+    linha = []
+    for coluna, valor in zip(colunas, valores):
+        if valor is None and coluna == "processado":
+            valor = 0
+        if valor is None:
+            raise ValueError(f"Campo obrigatório ausente: {coluna}")
+        if coluna in COLUNAS_TEXTO:
+            valor = str(valor)
+            if not valor.strip():
+                raise ValueError(f"Campo obrigatório vazio: {coluna}")
+            linha.append(valor)
+        elif isinstance(valor, bool) or not isinstance(valor, (int, str)):
+            raise ValueError(f"Campo {coluna} deve ser inteiro")
+        else:
+            valor = int(valor)
+            # As colunas são INTEGER: um valor fora da faixa derrubaria o COPY do lote inteiro
+            if not INT32_MIN <= valor <= INT32_MAX:
+                raise ValueError(f"Campo {coluna} fora da faixa de INTEGER: {valor}")
+            linha.append(valor)
+    return linha
+
+
+async def ler_registros(request: Request):
+    """Gera (número da linha, registro) a partir de um array JSON ou de um corpo NDJSON lido em streaming"""
+    tipo = request.headers.get("content-type", "")
+    if "ndjson" in tipo or "jsonlines" in tipo or "x-jsonl" in tipo:
+        numero = 0
+        resto = b""
+        async for pedaco in request.stream():
+            resto += pedaco
+            *linhas, resto = resto.split(b"\n")
+            for linha in linhas:
+                numero += 1
+                if linha.strip():
+                    yield numero, linha
+        if resto.strip():
+            yield numero + 1, resto
+    else:
+        try:
+            dados = json.loads(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"JSON inválido: {e}")
+        if not isinstance(dados, list):
+            raise HTTPException(status_code=400, detail="O corpo deve ser um array JSON ou NDJSON")
+        for numero, registro in enumerate(dados, start=1):
+            yield numero, registro
+
+
+def copiar_lote(conn, tabela, colunas, lote):
+    """Carrega um lote via COPY FROM STDIN; retorna quantas linhas foram efetivamente inseridas"""
+    buffer = io.StringIO()
+    # Strings sempre entre aspas: no CSV do COPY, campo vazio sem aspas vira NULL
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(lote)
+    buffer.seek(0)
+    lista_colunas = ", ".join(colunas)
+    with conn.cursor() as cursor:
+        if tabela != "classificados":
+            cursor.copy_expert(f"COPY {tabela} ({lista_colunas}) FROM STDIN WITH (FORMAT csv)", buffer)
+            return len(lote)
+        # flow_id é UNIQUE em classificados: passa por uma tabela temporária e ignora duplicados
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS bulk_classificados ON COMMIT DELETE ROWS AS "
+            f"SELECT {lista_colunas} FROM classificados WITH NO DATA"
+        )
+        cursor.execute("TRUNCATE bulk_classificados")
+        cursor.copy_expert(f"COPY bulk_classificados ({lista_colunas}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO classificados ({lista_colunas}) SELECT {lista_colunas} FROM bulk_classificados "
+            f"ON CONFLICT (flow_id) DO NOTHING"
+        )
+        return cursor.rowcount
+
+
+async def carregar_em_massa(request: Request, tabela: str, colunas: list):
+    """Valida e carrega todos os registros do corpo em uma única transação, em lotes de BULK_BATCH_SIZE"""
+    conn = await run_in_threadpool(pool.obter)
+    descartar = False
+    lotes, rejeitados, total_rejeitados, lote = [], [], 0, []
+
+    async def enviar():
+        inseridos = await run_in_threadpool(copiar_lote, conn, tabela, colunas, lote)
+        lotes.append({"lote": len(lotes) + 1, "recebidos": len(lote), "inseridos": inseridos,
+                      "ignorados": len(lote) - inseridos})
+
+    try:
+        async for numero, registro in ler_registros(request):
+            try:
+                if isinstance(registro, bytes):
+                    registro = json.loads(registro)
+                lote.append(validar_registro(registro, colunas))
+            except (ValueError, TypeError) as e:
+                total_rejeitados += 1
+                if len(rejeitados) < BULK_MAX_REJEITADOS:
+                    rejeitados.append({"linha": numero, "erro": str(e)})
+            if len(lote) >= BULK_BATCH_SIZE:
+                await enviar()
+                lote = []
+        if lote:
+            await enviar()
+        await run_in_threadpool(conn.commit)
+    except HTTPException:
+        await run_in_threadpool(conn.rollback)
+        raise
+    except psycopg2.Error as e:
+        try:
+            await run_in_threadpool(conn.rollback)
+        except psycopg2.Error:
+            descartar = True
+        raise HTTPException(status_code=500, detail=f"Erro ao inserir dados em {tabela}: {e}")
+    except BaseException:
+        # Cliente desconectado, cancelamento ou erro inesperado no meio do COPY: a transação
+        # fica pela metade e a conexão é descartada (sem esperar um rollback no event loop)
+        descartar = True
+        raise
+    finally:
+        pool.devolver(conn, descartar=descartar)
+
+    return {
+        "tabela": tabela,
+        "inseridos": sum(l["inseridos"] for l in lotes),
+        "lotes": lotes,
+        "total_rejeitados": total_rejeitados,
+        "rejeitados": rejeitados,
+    }
+
+@app.post("/dados/trafego/bulk")
+async def inserir_trafego_em_massa(request: Request, token: dict = Depends(verificar_token_jwt)):
+    """
+    Insere vários fluxos em trafego. Aceita um array JSON ou NDJSON (application/x-ndjson),
+    com objetos por nome de coluna ou listas na ordem das colunas.
+    """
+    return await carregar_em_massa(request, "trafego", COLUNAS_TRAFEGO)
+
+@app.post("/dados/ataques/bulk")
+async def inserir_ataques_em_massa(request: Request, token: dict = Depends(verificar_token_jwt)):
+    """Mesmo formato de /dados/trafego/bulk, com 'class' (ou 'classe') e 'processado' opcional; flow_ids repetidos são ignorados"""
+    return await carregar_em_massa(request, "classificados", COLUNAS_CLASSIFICADOS)
+
+class Fluxo(BaseModel):
+    flow_id: str
+    src_ip: str
+    dest_ip: str
+    src_port: int
+    dest_port: int
+    proto: str
+    hour: int
+    minute: int
+    seconds: int
+    severity: int
+    pkts_toserver: int
+    pkts_toclient: int
+    bytes_toserver: int
+    bytes_toclient: int
+
+def salvar_classificados(linhas):
+    """Grava os fluxos maliciosos classificados pela API (executado após a resposta)"""
+    try:
+        with obter_conexao() as conn:
+            copiar_lote(conn, "classificados", COLUNAS_CLASSIFICADOS, linhas)
+            conn.commit()
+    except Exception as e:
+        print(f"[API] Erro ao salvar fluxos classificados: {e}")
+
+@app.post("/classificar")
+async def classificar_fluxos(fluxos: List[Fluxo], tarefas: BackgroundTasks, token: dict = Depends(verificar_token_jwt)):
+    """
+    Classifica os fluxos de forma síncrona e devolve classe e confiança de cada um.
+    Os maliciosos são gravados em classificados em segundo plano.
+    """
+    if agrupador is None:
+        raise HTTPException(status_code=503, detail="Classificação pela API indisponível")
+    if not fluxos:
+        return {"resultados": []}
+
+    import pandas as pd
+
+    df = pd.DataFrame([fluxo.model_dump() for fluxo in fluxos], columns=COLUNAS_TRAFEGO)
+    try:
+        classes, confiancas = await agrupador.classificar(df)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    import classifier
+    resultados, maliciosos = [], []
+    for fluxo, classe, confianca in zip(fluxos, classes, confiancas):
+        resultados.append({"flow_id": fluxo.flow_id, "classe": classe, "confianca": float(confianca)})
+        if classe in classifier.MALICIOUS_CLASSES:
+            maliciosos.append([getattr(fluxo, coluna) for coluna in COLUNAS_TRAFEGO] + [classe, 0])
+    if maliciosos:
+        tarefas.add_task(salvar_classificados, maliciosos)
+    return {"resultados": resultados}
+
 @app.get("/dados/ataques/novos")
 def obter_dados_ataques(token: dict = Depends(verificar_token_jwt)):
     dados = executar_query(query = "SELECT flow_id, src_ip, dest_ip, src_port, dest_port, proto, hour, minute, seconds, severity, pkts_toserver, pkts_toclient, bytes_toserver, bytes_toclient, class, processado FROM classificados WHERE class NOT IN ('normal', 'Benign') AND processado = 0", fetchall=True)
     return {"dados": dados}
 
+async def transmitir_eventos(request: Request, fila):
+    """Server-sent events: 'pronto' ao conectar, 'ataques' a cada aviso e keep-alive periódico"""
+    try:
+        yield "event: pronto\ndata: {}\n\n"
+        while True:
+            try:
+                evento = await asyncio.wait_for(fila.get(), EVENTOS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: ataques\ndata: {json.dumps(evento)}\n\n"
+    finally:
+        notificador.cancelar(fila)
+
+@app.get("/dados/ataques/eventos")
+async def eventos_ataques(request: Request, token: dict = Depends(verificar_token_jwt)):
+    """
+    Stream (text/event-stream) avisando quando novos ataques entram em classificados ou reservas
+    são liberadas. O evento só sinaliza; os ataques continuam sendo obtidos por /dados/ataques/reservar.
+    """
+    fila = notificador.assinar()
+    return StreamingResponse(
+        transmitir_eventos(request, fila),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.put("/dados/ataques/processar/{flow_id}")
 def atualizar_ataque_processado(flow_id: str, token: dict = Depends(verificar_token_jwt)):
     """
@@ -151,6 +781,124 @@ def atualizar_ataque_processado(flow_id: str, token: dict = Depends(verificar_to
 
     return {"mensagem": f"Ataque {flow_id} marcado como processado!"}
 
+class FlowIds(BaseModel):
+    flow_ids: List[str]
+
+@app.put("/dados/ataques/processar")
+def atualizar_ataques_processados(corpo: FlowIds, consumidor: Optional[str] = None, token: dict = Depends(verificar_token_jwt)):
+    """
+    Marca vários ataques como processados em um único UPDATE.
+    Com `consumidor`, só são marcados os ataques reservados por ele (os de outra réplica ficam intactos).
+    Devolve quantos foram atualizados; flow_ids inexistentes, já processados ou de outra reserva são ignorados.
+    """
+    flow_ids = list(dict.fromkeys(corpo.flow_ids))
+    if not flow_ids:
+        return {"atualizados": 0}
+
+    query = "UPDATE classificados SET processado = 1 WHERE flow_id = ANY(%s) AND processado = 0"
+    parametros = (flow_ids,)
+    if consumidor:
+        query += " AND reservado_por = %s"
+        parametros += (consumidor,)
+    with obter_conexao() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, parametros)
+            atualizados = cursor.rowcount
+        conn.commit()
+
+    return {"atualizados": atualizados}
+
+@app.post("/dados/ataques/reservar")
+def reservar_ataques(
+    limite: int = Query(PAGINA_PADRAO, ge=1, le=PAGINA_MAXIMA),
+    duracao: int = Query(RESERVA_DURACAO, ge=1, le=RESERVA_DURACAO_MAXIMA),
+    consumidor: Optional[str] = None,
+    token: dict = Depends(verificar_token_jwt)
+):
+    """
+    Reserva atomicamente até `limite` ataques não processados por `duracao` segundos.
+    Linhas já reservadas (e ainda dentro do prazo) ou travadas por outra reserva concorrente são
+    puladas (SKIP LOCKED), então vários consumidores dividem os ataques sem duplicidade.
+    Uma reserva que expira sem o ataque ser processado volta a ficar disponível.
+    """
+    consumidor = consumidor or token.get("sub")
+    with obter_conexao() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                WITH alvo AS (
+                    SELECT id FROM classificados
+                    WHERE processado = 0 AND class NOT IN ('normal', 'Benign')
+                      AND (reservado_ate IS NULL OR reservado_ate < now())
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE classificados c
+                SET reservado_ate = now() + make_interval(secs => %s), reservado_por = %s
+                FROM alvo
+                WHERE c.id = alvo.id
+                RETURNING c.id, c.flow_id, c.src_ip, c.dest_ip, c.src_port, c.dest_port, c.proto, c.hour, c.minute, c.seconds,
+                          c.severity, c.pkts_toserver, c.pkts_toclient, c.bytes_toserver, c.bytes_toclient, c.class, c.processado
+            """, (limite, duracao, consumidor))
+            linhas = cursor.fetchall()
+        conn.commit()
+
+    # Mesmo formato de /dados/ataques/novos, na ordem de chegada
+    dados = [linha[1:] for linha in sorted(linhas)]
+    return {"dados": dados, "reservado_por": consumidor, "duracao": duracao}
+
+@app.post("/dados/ataques/renovar")
+def renovar_reservas(
+    corpo: FlowIds,
+    duracao: int = Query(RESERVA_DURACAO, ge=1, le=RESERVA_DURACAO_MAXIMA),
+    consumidor: Optional[str] = None,
+    token: dict = Depends(verificar_token_jwt)
+):
+    """
+    Estende por `duracao` segundos a reserva de ataques ainda em processamento pelo consumidor.
+    Devolve os flow_ids renovados; os ausentes já foram processados ou perderam a reserva.
+    """
+    consumidor = consumidor or token.get("sub")
+    flow_ids = list(dict.fromkeys(corpo.flow_ids))
+    if not flow_ids:
+        return {"renovados": []}
+
+    with obter_conexao() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """UPDATE classificados SET reservado_ate = now() + make_interval(secs => %s)
+                   WHERE flow_id = ANY(%s) AND processado = 0 AND reservado_por = %s
+                   RETURNING flow_id""",
+                (duracao, flow_ids, consumidor)
+            )
+            renovados = [linha[0] for linha in cursor.fetchall()]
+        conn.commit()
+
+    return {"renovados": renovados}
+
+@app.post("/dados/ataques/liberar")
+def liberar_ataques(corpo: FlowIds, consumidor: Optional[str] = None, token: dict = Depends(verificar_token_jwt)):
+    """Desfaz a reserva de ataques não processados (ex.: falha no pipeline) para que voltem à fila imediatamente"""
+    consumidor = consumidor or token.get("sub")
+    flow_ids = list(dict.fromkeys(corpo.flow_ids))
+    if not flow_ids:
+        return {"liberados": 0}
+
+    with obter_conexao() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """UPDATE classificados SET reservado_ate = NULL, reservado_por = NULL
+                   WHERE flow_id = ANY(%s) AND processado = 0 AND reservado_por = %s""",
+                (flow_ids, consumidor)
+            )
+            liberados = cursor.rowcount
+            if liberados:
+                # Entregue no commit: os assinantes de /dados/ataques/eventos buscam de novo
+                cursor.execute("SELECT pg_notify(%s, %s)", (CANAL_ATAQUES, str(liberados)))
+        conn.commit()
+
+    return {"liberados": liberados}
+
 def run_api(host="0.0.0.0", port=5050):
     uvicorn.run(app, host=host, port=port)
 
@@ -0,0 +1,265 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import resource
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import ProgrammingError
+
+from classifier import Classifier, FEATURE_COLUMNS, MALICIOUS_CLASSES, DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+
+MODEL_PATH = os.getenv("MODEL_PATH", "/models/flower-uiot.keras")
+TAMANHOS_PADRAO = "1,10,100,1000,10000,100000"
+ETAPAS = ("carregar", "preprocessar", "predizer", "salvar")
+COLUNAS_TEXTO = {"flow_id", "src_ip", "dest_ip", "proto"}
+
+# Distribuições aproximadas do que os sensores veem: poucos hosts internos concentram os fluxos,
+# muitos destinos externos com cauda longa, maioria TCP e portas de serviço bem conhecidas
+PROTOCOLOS = (["TCP", "UDP", "ICMP"], [0.78, 0.20, 0.02])
+PORTAS_SERVICO = ([443, 80, 53, 22, 123, 25, 3389, 8080, 445, 993],
+                  [0.42, 0.18, 0.15, 0.05, 0.04, 0.03, 0.03, 0.04, 0.03, 0.03])
+INT32_MAX = 2**31 - 1
+
+
+def _zipf_indices(rng, n, cardinalidade, a=1.2):
+    """Índices em [0, cardinalidade) com frequência decrescente (Zipf truncado)"""
+    pesos = 1.0 / np.arange(1, cardinalidade + 1) ** a
+    return rng.choice(cardinalidade, size=n, p=pesos / pesos.sum())
+
+
+def gerar_trafego(n, rng, hosts_internos=250, destinos_externos=20000, primeiro_flow_id=0):
+    """Linhas sintéticas de trafego (FEATURE_COLUMNS) com cardinalidades realistas de IP/protocolo"""
+    internos = np.array([f"10.0.{i // 256}.{i % 256}" for i in range(1, hosts_internos + 1)])
+    externos = np.array([
+        f"{a}.{b}.{c}.{d}" for a, b, c, d in rng.integers([11, 0, 0, 1], [223, 256, 256, 255], size=(destinos_externos, 4))
+    ])
+    interno = internos[_zipf_indices(rng, n, hosts_internos)]
+    externo = externos[_zipf_indices(rng, n, destinos_externos)]
+    # 70% dos fluxos saem da rede interna
+    saida = rng.random(n) < 0.7
+
+    proto = rng.choice(PROTOCOLOS[0], size=n, p=PROTOCOLOS[1])
+    dest_port = rng.choice(PORTAS_SERVICO[0], size=n, p=PORTAS_SERVICO[1])
+    efemera = rng.random(n) < 0.1
+    dest_port[efemera] = rng.integers(1024, 65536, size=efemera.sum())
+    src_port = rng.integers(1024, 65536, size=n)
+    icmp = proto == "ICMP"
+    src_port[icmp] = 0
+    dest_port[icmp] = 0
+
+    segundos_do_dia = np.sort(rng.integers(0, 86400, size=n))
+    pkts_toserver = (rng.lognormal(2.0, 1.2, size=n) + 1).astype(np.int64)
+    pkts_toclient = (rng.lognormal(1.8, 1.3, size=n)).astype(np.int64)
+    bytes_toserver = np.minimum(pkts_toserver * rng.lognormal(5.5, 0.8, size=n), INT32_MAX).astype(np.int64)
+    bytes_toclient = np.minimum(pkts_toclient * rng.lognormal(6.5, 0.9, size=n), INT32_MAX).astype(np.int64)
+    severity = np.where(rng.random(n) < 0.95, 0, rng.integers(1, 4, size=n))
+
+    return pd.DataFrame({
+        "flow_id": (np.arange(n, dtype=np.int64) + primeiro_flow_id).astype(str),
+        "src_ip": np.where(saida, interno, externo),
+        "dest_ip": np.where(saida, externo, interno),
+        "src_port": src_port,
+        "dest_port": dest_port,
+        "proto": proto,
+        "hour": segundos_do_dia // 3600,
+        "minute": segundos_do_dia // 60 % 60,
+        "seconds": segundos_do_dia % 60,
+        "severity": severity,
+        "pkts_toserver": pkts_toserver,
+        "pkts_toclient": pkts_toclient,
+        "bytes_toserver": bytes_toserver,
+        "bytes_toclient": bytes_toclient,
+    })[FEATURE_COLUMNS]
+
+
+def carregar_parquet(path):
+    """Fluxos reais gravados pelo ingester em Parquet: só as colunas do classificador, com memory map"""
+    return pd.read_parquet(path, columns=FEATURE_COLUMNS, memory_map=True)
+
+
+def amostrar_fluxos(base, n, rng, primeiro_flow_id=0):
+    """Reamostra n fluxos de base; flow_id é UNIQUE em classificados, então recebem ids novos"""
+    df = base.iloc[rng.integers(0, len(base), size=n)].reset_index(drop=True)
+    df["flow_id"] = (np.arange(n, dtype=np.int64) + primeiro_flow_id).astype(str)
+    return df
+
+
+def criar_engine(banco, sqlite_path, schema):
+    """SQLite local como substituto ou um schema isolado no PostgreSQL (nunca as tabelas de produção)"""
+    if banco == "sqlite":
+        return create_engine(f"sqlite:///{sqlite_path}")
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", schema) or schema == "public" or schema.startswith("pg_"):
+        raise ValueError(f"[Benchmark] Schema inválido: {schema!r}. Use um nome novo e dedicado.")
+    engine = create_engine(
+        f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
+        connect_args={"options": f"-csearch_path={schema}"},
+    )
+    # Sem IF NOT EXISTS: o schema é removido com CASCADE ao final, então precisa ter sido criado aqui
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA "{schema}"'))
+    except ProgrammingError:
+        engine.dispose()
+        raise ValueError(f"[Benchmark] O schema {schema!r} já existe; escolha outro ou omita --schema.")
+    return engine
+
+
+def criar_tabelas(engine):
+    colunas = ", ".join(f"{c} {'TEXT' if c in COLUNAS_TEXTO else 'INTEGER'} NOT NULL" for c in FEATURE_COLUMNS)
+    if engine.dialect.name == "sqlite":
+        id_trafego, id_classificados, criado_em = "INTEGER PRIMARY KEY", "INTEGER PRIMARY KEY", "TIMESTAMP"
+        xid = ""
+    else:
+        id_trafego, id_classificados, criado_em = "BIGSERIAL PRIMARY KEY", "SERIAL PRIMARY KEY", "TIMESTAMPTZ"
+        # Mesma coluna do init_db: a marca d'água no PostgreSQL é (xid, id)
+        xid = ", xid BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint"
+    with engine.begin() as conn:
+        for tabela in ("trafego", "classificados", "classificador_estado"):
+            conn.execute(text(f"DROP TABLE IF EXISTS {tabela}"))
+        conn.execute(text(f"CREATE TABLE trafego (id {id_trafego}, {colunas}, criado_em {criado_em} NOT NULL{xid})"))
+        conn.execute(text(
+            f"CREATE TABLE classificados (id {id_classificados}, {colunas}, class TEXT NOT NULL, "
+            "processado INTEGER DEFAULT 0, UNIQUE (flow_id))"
+        ))
+        conn.execute(text(
+            "CREATE TABLE classificador_estado (nome TEXT PRIMARY KEY, ultimo_xid BIGINT NOT NULL DEFAULT 0, "
+            "ultimo_id BIGINT NOT NULL DEFAULT 0, "
+            "atualizado_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        ))
+
+
+def inserir_trafego(engine, df):
+    df = df.assign(criado_em=pd.Timestamp.now(tz="UTC"))
+    if engine.dialect.name == "sqlite":
+        df["criado_em"] = df["criado_em"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    with engine.begin() as conn:
+        df.to_sql("trafego", conn, if_exists="append", index=False, chunksize=2000,
+                  method="multi" if engine.dialect.name != "sqlite" else None)
+
+
+def executar_lote(classifier, marca, medir_memoria=False):
+    """Uma iteração de Classifier.run com tempo (e, opcionalmente, pico de memória) por etapa"""
+    tempos, memoria = {}, {}
+
+    def etapa(nome, funcao):
+        if medir_memoria:
+            tracemalloc.start()
+        inicio = time.perf_counter()
+        # As etapas imprimem progresso; fora do benchmark isso é log, aqui seria ruído
+        with contextlib.redirect_stdout(io.StringIO()):
+            resultado = funcao()
+        tempos[nome] = time.perf_counter() - inicio
+        if medir_memoria:
+            memoria[nome] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return resultado
+
+    df = etapa("carregar", lambda: classifier.load_data(marca))
+    marca = classifier.pop_watermark(df)
+    X, _ = etapa("preprocessar", lambda: classifier.preprocess_data(df))
+    predicoes = etapa("predizer", lambda: classifier.predict(X))
+    etapa("salvar", lambda: classifier.save_malicious_predictions(df, predicoes, marca=marca))
+    maliciosos = int(df["class"].isin(MALICIOUS_CLASSES).sum())
+    return marca, len(df), tempos, memoria, maliciosos
+
+
+def medir_tamanho(classifier, engine, tamanho, repeticoes, fonte, primeiro_flow_id):
+    """Insere repeticoes+1 lotes de `tamanho` fluxos e classifica um lote por vez a partir da marca d'água"""
+    inserir_trafego(engine, fonte(tamanho * (repeticoes + 1), primeiro_flow_id))
+    classifier.batch_size = tamanho
+    marca = classifier.load_watermark()
+
+    # Lote extra só para memória: tracemalloc deixa as alocações mais lentas e distorceria os tempos
+    marca, _, _, memoria, _ = executar_lote(classifier, marca, medir_memoria=True)
+
+    amostras = {etapa: [] for etapa in ETAPAS}
+    totais, fluxos, maliciosos = [], 0, 0
+    for _ in range(repeticoes):
+        marca, n, tempos, _, m = executar_lote(classifier, marca)
+        for etapa in ETAPAS:
+            amostras[etapa].append(tempos[etapa])
+        totais.append(sum(tempos.values()))
+        fluxos += n
+        maliciosos += m
+
+    resultado = {"tamanho": tamanho, "repeticoes": repeticoes, "fracao_maliciosa": round(maliciosos / fluxos, 4)}
+    for etapa in ETAPAS + ("total",):
+        valores = np.array(totais if etapa == "total" else amostras[etapa])
+        resultado[etapa] = {
+            "fluxos_por_s": round(tamanho / np.median(valores), 1),
+            "p50_ms": round(float(np.percentile(valores, 50)) * 1000, 3),
+            "p99_ms": round(float(np.percentile(valores, 99)) * 1000, 3),
+        }
+        if etapa in memoria:
+            resultado[etapa]["pico_mb"] = round(memoria[etapa] / 2**20, 2)
+    # ru_maxrss é em KB no Linux e acumula durante o processo
+    resultado["rss_processo_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return resultado
+
+
+def imprimir(resultados):
+    print(f"{'lote':>8} {'etapa':<13} {'fluxos/s':>12} {'p50 ms':>10} {'p99 ms':>10} {'pico MB':>9}")
+    for r in resultados:
+        for etapa in ETAPAS + ("total",):
+            e = r[etapa]
+            pico = f"{e['pico_mb']:>9.2f}" if "pico_mb" in e else f"{'-':>9}"
+            print(f"{r['tamanho']:>8} {etapa:<13} {e['fluxos_por_s']:>12.1f} {e['p50_ms']:>10.3f} {e['p99_ms']:>10.3f} {pico}")
+        print(f"{'':>8} rss do processo: {r['rss_processo_mb']} MB, fração maliciosa: {r['fracao_maliciosa']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de Classifier: carga, pré-processamento, predição e gravação")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--banco", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--sqlite-path", help="Arquivo SQLite (padrão: temporário)")
+    parser.add_argument("--schema", default=f"benchmark_{uuid.uuid4().hex[:12]}",
+                        help="Schema novo criado no PostgreSQL e removido ao final (padrão: nome único)")
+    parser.add_argument("--tamanhos", default=TAMANHOS_PADRAO, help="Tamanhos de lote separados por vírgula")
+    parser.add_argument("--repeticoes", type=int, default=20)
+    parser.add_argument("--max-fluxos", type=int, default=500000,
+                        help="Limita as repetições dos lotes grandes a este total de fluxos por tamanho")
+    parser.add_argument("--parquet", help="Usa fluxos reais de um Parquet do ingester em vez dos sintéticos")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", help="Grava os resultados em JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = criar_engine(args.banco, args.sqlite_path or os.path.join(tmp, "benchmark.db"), args.schema)
+        try:
+            criar_tabelas(engine)
+            with contextlib.redirect_stdout(io.StringIO()):
+                classifier = Classifier(args.model, watermark_name="benchmark", engine=engine)
+            rng = np.random.default_rng(args.seed)
+            if args.parquet:
+                base = carregar_parquet(args.parquet)
+                print(f"[Benchmark] {len(base)} fluxos carregados de {args.parquet}.")
+                fonte = lambda n, primeiro: amostrar_fluxos(base, n, rng, primeiro)
+            else:
+                fonte = lambda n, primeiro: gerar_trafego(n, rng, primeiro_flow_id=primeiro)
+
+            resultados = []
+            proximo_flow_id = 10**12
+            for tamanho in (int(t) for t in args.tamanhos.split(",")):
+                repeticoes = max(3, min(args.repeticoes, args.max_fluxos // tamanho))
+                print(f"[Benchmark] Lote de {tamanho} fluxos, {repeticoes} repetições...")
+                resultados.append(medir_tamanho(classifier, engine, tamanho, repeticoes, fonte, proximo_flow_id))
+                proximo_flow_id += tamanho * (repeticoes + 1)
+
+            imprimir(resultados)
+            if args.saida:
+                with open(args.saida, "w") as f:
+                    json.dump({"banco": args.banco, "modelo": args.model, "resultados": resultados}, f, indent=2)
+        finally:
+            if args.banco == "postgres":
+                with engine.begin() as conn:
+                    conn.execute(text(f'DROP SCHEMA "{args.schema}" CASCADE'))
+            engine.dispose()
@@ -1,13 +1,14 @@
-import tensorflow as tf
 import pandas as pd
 import numpy as np
-import keras
 import psycopg2
 import os
-from sqlalchemy import create_engine
+import io
+import json
+from sqlalchemy import create_engine, text
 from typing import Dict
 from sklearn import preprocessing
 import time
+from collections import Counter
 
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
@@ -18,6 +19,29 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
 LABEL_MAPPING = {0: "Botnet", 1: "Bruteforce", 2: "DoS", 3: "Normal", 4: "Scan"}
 MALICIOUS_CLASSES = {"Botnet", "Bruteforce", "DoS", "Scan"}
 
+# Quantidade máxima de fluxos lidos de trafego por iteração e nome da marca d'água em classificador_estado
+BATCH_SIZE = int(os.getenv("CLASSIFIER_BATCH_SIZE", 5000))
+WATERMARK_NAME = os.getenv("CLASSIFIER_NAME", "classifier")
+# No PostgreSQL a marca d'água é (trafego.xid, trafego.id): ids de transações ainda abertas podem ser
+# confirmados fora de ordem (ex.: várias tarefas JDBC do Spark, COPY longos), então só são lidos fluxos
+# de transações abaixo do xmin do snapshot, que já terminaram todas. Nos demais bancos, só o id
+# Workers em paralelo: trafego é dividido em CLASSIFIER_SHARDS partes pelo hash do flow_id, cada uma
+# com sua marca d'água. CLASSIFIER_SHARD_IDS escolhe quais partes este nó executa (padrão: todas)
+SHARDS = int(os.getenv("CLASSIFIER_SHARDS", 1))
+SHARD_IDS = os.getenv("CLASSIFIER_SHARD_IDS", "")
+
+# Backend de inferência: keras (TensorFlow), numpy (sem dependências), tflite ou onnx.
+# Os backends sem Keras usam os arquivos gerados por export_model.py ao lado do .keras
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras")
+
+# Tamanho máximo de cada chamada ao modelo (limita a memória de ativações em blocos grandes)
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", 8192))
+
+FEATURE_COLUMNS = [
+    "flow_id", "src_ip", "dest_ip", "src_port", "dest_port", "proto", "hour", "minute", "seconds",
+    "severity", "pkts_toserver", "pkts_toclient", "bytes_toserver", "bytes_toclient"
+]
+
 def conectar():
     return psycopg2.connect(
         host=DB_HOST,
@@ -28,7 +52,8 @@ def conectar():
     )
 
 def get_sqlalchemy_engine():
-    return create_engine(f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+    # pool_pre_ping: o engine vive por todo o processo e precisa sobreviver a quedas do banco
+    return create_engine(f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}", pool_pre_ping=True)
 
 def check_table_size(table_name: str, engine) -> int:
     query = f"SELECT COUNT(*) FROM {table_name}"
@@ -38,24 +63,414 @@ def check_table_size(table_name: str, engine) -> int:
     return count
 
 
+def labels_from_probabilities(predictions: np.ndarray, threshold: float = 0.7):
+    """Classe mais provável de cada fluxo; abaixo do limiar de confiança o fluxo é tratado como Normal"""
+    confidences = np.max(predictions, axis=1)
+    predicted_temp = np.argmax(predictions, axis=1)
+    predicted_indices = np.where(confidences >= threshold, predicted_temp, 3)  # 3 = Normal
+    return [LABEL_MAPPING[i] for i in predicted_indices], confidences
+
+
+def preprocessing_path_for(model_path: str) -> str:
+    """Artefatos exportados pelo treino (client.export_preprocessing) ficam ao lado do .keras"""
+    return os.path.splitext(model_path)[0] + ".preprocessing.json"
+
+
+class Preprocessor:
+    """
+    Pré-processamento ajustado no treino: vocabulários das colunas categóricas e média/escala
+    do StandardScaler. Independe do lote, então serve para lotes pequenos e fluxos isolados.
+    """
+
+    def __init__(self, columns, mean, scale, vocabularies):
+        self.columns = columns
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        # Índices com hash: get_indexer faz a busca de todos os valores de uma vez
+        self.vocabularies = {col: pd.Index(values) for col, values in vocabularies.items()}
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            artifacts = json.load(f)
+        return cls(artifacts["columns"], artifacts["mean"], artifacts["scale"], artifacts["vocabularies"])
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        X = np.empty((len(df), len(self.columns)), dtype=np.float64)
+        for i, col in enumerate(self.columns):
+            if col in self.vocabularies:
+                # Valores fora do vocabulário viram -1, como o cat.codes do treino faz com ausentes
+                X[:, i] = self.vocabularies[col].get_indexer(df[col].astype(str))
+            else:
+                X[:, i] = pd.to_numeric(df[col], errors="coerce").fillna(0).to_numpy()
+        return ((X - self.mean) / self.scale).astype(np.float32)
+
+
+def _as_int(value):
+    """Configs do Keras guardam tamanhos 1D como int, lista ou tupla"""
+    return int(value[0]) if isinstance(value, (list, tuple)) else int(value)
+
+
+def _pad_same(x, window, stride, value):
+    """Padding 'same' do Keras no eixo temporal (sobra vai para o fim)"""
+    length = x.shape[1]
+    out_length = -(-length // stride)
+    total = max((out_length - 1) * stride + window - length, 0)
+    if total == 0:
+        return x
+    return np.pad(x, ((0, 0), (total // 2, total - total // 2), (0, 0)), constant_values=value)
+
+
+def _activation(x, name):
+    if name in (None, "linear"):
+        return x
+    if name == "relu":
+        return np.maximum(x, 0)
+    if name == "softmax":
+        e = np.exp(x - x.max(axis=-1, keepdims=True))
+        return e / e.sum(axis=-1, keepdims=True)
+    if name == "sigmoid":
+        return 1 / (1 + np.exp(-x))
+    if name == "tanh":
+        return np.tanh(x)
+    raise ValueError(f"[Classifier] Ativação não suportada no backend numpy: {name}")
+
+
+class NumpyBackend:
+    """
+    Implementação em NumPy da pilha Conv1D/MaxPooling1D/Flatten/Dense (Dropout é ignorado)
+    a partir dos pesos e da arquitetura exportados por export_model.py (.npz).
+    """
+
+    def __init__(self, path: str):
+        with np.load(path, allow_pickle=False) as data:
+            architecture = json.loads(str(data["architecture"]))
+            self.layers = [
+                (layer["type"], layer["config"], [data[key].astype(np.float32) for key in layer["weights"]])
+                for layer in architecture["layers"]
+            ]
+            self.input_shape = tuple(architecture["input_shape"])
+            self.output_dim = architecture["output_dim"]
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        x = X
+        for layer_type, config, weights in self.layers:
+            if layer_type == "Conv1D":
+                kernel, bias = weights
+                stride = _as_int(config.get("strides", 1))
+                if config.get("padding") == "same":
+                    x = _pad_same(x, kernel.shape[0], stride, 0.0)
+                k, c, o = kernel.shape
+                # Janelas (n, l, c, k) -> (n*l, k*c): a convolução vira um único produto de matrizes
+                windows = np.lib.stride_tricks.sliding_window_view(x, k, axis=1)[:, ::stride]
+                n, l = windows.shape[:2]
+                cols = windows.transpose(0, 1, 3, 2).reshape(n * l, k * c)
+                x = _activation((cols @ kernel.reshape(k * c, o)).reshape(n, l, o) + bias, config.get("activation"))
+            elif layer_type in ("MaxPooling1D", "MaxPool1D"):
+                pool = _as_int(config.get("pool_size", 2))
+                stride = _as_int(config.get("strides") or pool)
+                if config.get("padding") == "same":
+                    x = _pad_same(x, pool, stride, -np.inf)
+                x = np.lib.stride_tricks.sliding_window_view(x, pool, axis=1)[:, ::stride].max(axis=-1)
+            elif layer_type == "Flatten":
+                x = x.reshape(x.shape[0], -1)
+            elif layer_type == "Dense":
+                kernel, bias = weights
+                x = _activation(x @ kernel + bias, config.get("activation"))
+            elif layer_type in ("Dropout", "InputLayer"):
+                continue
+            else:
+                raise ValueError(f"[Classifier] Camada não suportada no backend numpy: {layer_type}")
+        return x
+
+
+class KerasBackend:
+    def __init__(self, path: str):
+        import tensorflow as tf
+        import keras
+
+        # compile=False: só inferência, sem restaurar otimizador/métricas
+        model = keras.models.load_model(path, compile=False)
+        # Assinatura fixa com lote variável: um único trace, sem o overhead de model.predict por chamada
+        spec = tf.TensorSpec([None] + list(model.input_shape[1:]), tf.float32)
+        self._predict_fn = tf.function(lambda x: model(x, training=False), input_signature=[spec])
+        self.model = model
+        self.input_shape = tuple(model.input_shape[1:])
+        self.output_dim = model.output_shape[-1]
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self._predict_fn(X).numpy()
+
+
+class TFLiteBackend:
+    def __init__(self, path: str):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                from ai_edge_litert.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(self.input["shape"][1:])
+        self.output_dim = int(self.output["shape"][-1])
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        # O interpretador tem tamanho de lote fixo; redimensiona apenas quando o lote muda
+        if self.input["shape"][0] != len(X):
+            self.interpreter.resize_tensor_input(self.input["index"], [len(X), *self.input_shape])
+            self.interpreter.allocate_tensors()
+            self.input = self.interpreter.get_input_details()[0]
+        self.interpreter.set_tensor(self.input["index"], X)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output["index"])
+
+
+class ONNXBackend:
+    def __init__(self, path: str):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        entrada = self.session.get_inputs()[0]
+        self.input_name = entrada.name
+        self.input_shape = tuple(entrada.shape[1:])
+        self.output_dim = self.session.get_outputs()[0].shape[-1]
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: X})[0]
+
+
+BACKENDS = {
+    "keras": (KerasBackend, None),
+    "numpy": (NumpyBackend, ".npz"),
+    "tflite": (TFLiteBackend, ".tflite"),
+    "onnx": (ONNXBackend, ".onnx"),
+}
+
+
+def backend_path_for(model_path: str, backend: str) -> str:
+    """Arquivo usado por cada backend: o próprio .keras ou o artefato exportado ao lado dele"""
+    suffix = BACKENDS[backend][1]
+    return model_path if suffix is None else os.path.splitext(model_path)[0] + suffix
+
+
+class NIDSModel:
+    """
+    Modelo mantido em memória durante toda a vida do processo, com o backend de inferência
+    escolhido por INFERENCE_BACKEND. É recarregado apenas quando o arquivo do modelo ou dos
+    artefatos de pré-processamento muda (mtime/tamanho/inode), e aquecido logo após o carregamento.
+    """
+
+    def __init__(self, model_path: str, backend: str = INFERENCE_BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError(f"[Classifier] Backend de inferência desconhecido: {backend}")
+        self.model_path = model_path
+        self.backend_name = backend
+        self.backend_path = backend_path_for(model_path, backend)
+        self.preprocessing_path = preprocessing_path_for(model_path)
+        self.backend = None
+        self.preprocessor = None
+        self._signature = None
+
+    def _file_signature(self):
+        st = os.stat(self.backend_path)
+        try:
+            st_pre = os.stat(self.preprocessing_path)
+            pre = (st_pre.st_mtime_ns, st_pre.st_size, st_pre.st_ino)
+        except FileNotFoundError:
+            pre = None
+        return (st.st_mtime_ns, st.st_size, st.st_ino, pre)
+
+    def load(self):
+        if not os.path.exists(self.backend_path):
+            raise FileNotFoundError(f"[Classifier] Modelo não encontrado: {self.backend_path}")
+        signature = self._file_signature()
+        backend = BACKENDS[self.backend_name][0](self.backend_path)
+
+        if os.path.exists(self.preprocessing_path):
+            preprocessor = Preprocessor.load(self.preprocessing_path)
+            print(f"[Classifier] Pré-processamento do treino carregado de {self.preprocessing_path}.")
+        else:
+            preprocessor = None
+            print(f"[Classifier] AVISO: {self.preprocessing_path} não encontrado; o pré-processamento será "
+                  "ajustado por lote e as predições podem divergir do treino.")
+
+        # Só substitui o modelo em uso depois que tudo foi carregado
+        self.backend, self.preprocessor, self._signature = backend, preprocessor, signature
+        self.warmup()
+        print(f"[Classifier] Modelo carregado de {self.backend_path} (backend {self.backend_name}).")
+
+    @property
+    def model(self):
+        """Modelo Keras subjacente (apenas no backend keras)"""
+        return getattr(self.backend, "model", None)
+
+    def reload_if_changed(self) -> bool:
+        """Recarrega o modelo se o arquivo mudou; mantém o modelo atual se a nova versão falhar"""
+        try:
+            if self._file_signature() == self._signature:
+                return False
+        except FileNotFoundError:
+            return False
+        try:
+            print("[Classifier] Arquivo do modelo alterado, recarregando...")
+            self.load()
+            return True
+        except Exception as e:
+            print(f"[Classifier] Falha ao recarregar o modelo, mantendo a versão anterior: {e}")
+            return False
+
+    def classify(self, df: pd.DataFrame, threshold: float = 0.7):
+        """Classes e confianças de um DataFrame com FEATURE_COLUMNS; exige os artefatos do treino"""
+        if self.preprocessor is None:
+            raise RuntimeError("[Classifier] Artefatos de pré-processamento ausentes; classificação avulsa indisponível.")
+        return labels_from_probabilities(self.predict_proba(self.preprocessor.transform(df)), threshold)
+
+    @property
+    def n_features(self) -> int:
+        return self.backend.input_shape[0]
+
+    def warmup(self):
+        self.predict_proba(np.zeros((1, self.n_features), dtype=np.float32))
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        X = X.reshape(X.shape[0], X.shape[1], 1)
+        saidas = [
+            self.backend.predict(X[i:i + INFERENCE_BATCH_SIZE])
+            for i in range(0, len(X), INFERENCE_BATCH_SIZE)
+        ]
+        return np.concatenate(saidas) if saidas else np.empty((0, self.backend.output_dim), dtype=np.float32)
+
+
+def insert_ignore_duplicates(pd_table, conn, keys, data_iter):
+    """Método do to_sql que ignora flow_ids já existentes em classificados (UNIQUE)"""
+    if conn.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    stmt = insert(pd_table.table).values(rows).on_conflict_do_nothing(index_elements=["flow_id"])
+    return conn.execute(stmt).rowcount
+
+
+def copy_ignore_duplicates(conn, df: pd.DataFrame) -> int:
+    """
+    Grava df em classificados via COPY para uma tabela temporária e INSERT ... ON CONFLICT (flow_id)
+    DO NOTHING, na transação de conn. Retorna quantas linhas foram de fato inseridas.
+    """
+    colunas = ", ".join(df.columns)
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS staging_classificados ON COMMIT DELETE ROWS AS "
+            f"SELECT {colunas} FROM classificados WITH NO DATA"
+        )
+        cursor.execute("TRUNCATE staging_classificados")
+        cursor.copy_expert(f"COPY staging_classificados ({colunas}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO classificados ({colunas}) SELECT {colunas} FROM staging_classificados "
+            f"ON CONFLICT (flow_id) DO NOTHING"
+        )
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
 class Classifier:
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, batch_size: int = BATCH_SIZE, watermark_name: str = WATERMARK_NAME, engine=None,
+                 shard: int = 0, shards: int = 1):
+        if not 0 <= shard < shards:
+            raise ValueError(f"[Classifier] Shard inválido: {shard} de {shards}")
         self.model_path = model_path
         self.label_mapping = LABEL_MAPPING
-        self.connection = conectar()
-        self.engine = get_sqlalchemy_engine()
+        self.batch_size = batch_size
+        self.shard = shard
+        self.shards = shards
+        # Cada shard avança sua própria marca d'água: "classifier:1/4"
+        self.watermark_base = watermark_name
+        self.watermark_name = watermark_name if shards == 1 else f"{watermark_name}:{shard}/{shards}"
+        # engine opcional: permite apontar o classificador para outro banco (ex.: benchmark em SQLite)
+        self.engine = engine if engine is not None else get_sqlalchemy_engine()
+        self.model = NIDSModel(model_path)
+        self.model.load()
+
+    def load_watermark(self) -> tuple:
+        """(xid, id) do último fluxo de trafego já classificado ((0, 0) se o classificador nunca rodou)"""
+        with self.engine.connect() as conn:
+            marca = conn.execute(
+                text("SELECT ultimo_xid, ultimo_id FROM classificador_estado WHERE nome = :nome"),
+                {"nome": self.watermark_name}
+            ).first()
+            if marca is None:
+                # Primeira execução com esta divisão: parte da menor marca d'água existente (processo único
+                # ou outra quantidade de shards); o que for reclassificado é ignorado pelo ON CONFLICT
+                marca = conn.execute(
+                    text("SELECT ultimo_xid, ultimo_id FROM classificador_estado WHERE nome = :base OR nome LIKE :prefixo "
+                         "ORDER BY ultimo_xid, ultimo_id LIMIT 1"),
+                    {"base": self.watermark_base, "prefixo": f"{self.watermark_base}:%"}
+                ).first()
+        return (int(marca[0]), int(marca[1])) if marca is not None else (0, 0)
+
+    def save_watermark(self, conn, marca: tuple):
+        conn.execute(
+            text("INSERT INTO classificador_estado (nome, ultimo_xid, ultimo_id) VALUES (:nome, :ultimo_xid, :ultimo_id) "
+                 "ON CONFLICT (nome) DO UPDATE SET ultimo_xid = excluded.ultimo_xid, ultimo_id = excluded.ultimo_id, "
+                 "atualizado_em = CURRENT_TIMESTAMP"),
+            {"nome": self.watermark_name, "ultimo_xid": marca[0], "ultimo_id": marca[1]}
+        )
 
-    def load_data(self):
+    def load_data(self, after: tuple = (0, 0)):
+        """Próximo bloco de até batch_size fluxos após a marca d'água after, em ordem de (xid, id)"""
+        params = {"after_xid": after[0], "after_id": after[1], "limite": self.batch_size}
+        filtro_shard = ""
+        if self.shards > 1:
+            # hashtext só existe no PostgreSQL; nos demais bancos (benchmark) a divisão é pelo id
+            if self.engine.dialect.name == "postgresql":
+                filtro_shard = " AND abs(hashtext(flow_id)::bigint) % :shards = :shard"
+            else:
+                filtro_shard = " AND id % :shards = :shard"
+            params.update(shards=self.shards, shard=self.shard)
+
+        if self.engine.dialect.name == "postgresql":
+            # Transações com xid abaixo do xmin já foram confirmadas (ou abortadas): nenhum fluxo com
+            # (xid, id) até a marca d'água aparece depois. As ainda abertas têm xid >= xmin e esperam
+            query = (
+                f"SELECT id, xid, {', '.join(FEATURE_COLUMNS)} FROM trafego "
+                "WHERE (xid, id) > (:after_xid, :after_id) "
+                "AND xid < pg_snapshot_xmin(pg_current_snapshot())::text::bigint" + filtro_shard +
+                " ORDER BY xid, id LIMIT :limite"
+            )
+        else:
+            query = (
+                f"SELECT id, 0 AS xid, {', '.join(FEATURE_COLUMNS)} FROM trafego "
+                "WHERE id > :after_id" + filtro_shard + " ORDER BY id LIMIT :limite"
+            )
         try:
-            df = pd.read_sql("SELECT flow_id, src_ip, dest_ip, src_port, dest_port, proto, hour, minute, seconds, severity, pkts_toserver, pkts_toclient, bytes_toserver, bytes_toclient FROM trafego ORDER BY id DESC LIMIT 300", self.engine)
+            df = pd.read_sql(text(query), self.engine, params=params)
             if not df.empty:
                 return df
             else:
-                print("[Classifier] Nenhum dado encontrado na tabela 'trafego'.")
+                print("[Classifier] Nenhum dado novo na tabela 'trafego'.")
                 return None
         except Exception as e:
             raise RuntimeError(f"[Classifier] Erro ao carregar dados: {e}")
 
+    @staticmethod
+    def pop_watermark(df: pd.DataFrame) -> tuple:
+        """Remove id e xid do bloco e retorna a marca d'água do seu último fluxo"""
+        ids, xids = df.pop("id"), df.pop("xid")
+        return int(xids.iloc[-1]), int(ids.iloc[-1])
+
     def encode_data(self, df: pd.DataFrame):
         df_encoded = df.copy()
         categorical_columns = df_encoded.select_dtypes(include=["object"]).columns
@@ -64,6 +479,10 @@ class Classifier:
         return df_encoded
 
     def preprocess_data(self, df: pd.DataFrame):
+        preprocessor = self.model.preprocessor
+        if preprocessor is not None:
+            return preprocessor.transform(df), df
+
         df = df.dropna()
         df_encoded = self.encode_data(df)
         try:
@@ -73,70 +492,132 @@ class Classifier:
             X = df_encoded
             return X, df_encoded
 
-    def load_model(self):
-        if os.path.exists(self.model_path):
-            return keras.models.load_model(self.model_path)
-        else:
-            raise FileNotFoundError("[Classifier] Modelo não encontrado.")
-
-    def predict(self, model, X: pd.DataFrame, threshold: float = 0.7):
-        scaler = preprocessing.StandardScaler()
-        X = scaler.fit_transform(X)
-        X = X.reshape(X.shape[0], X.shape[1], 1)
-        predictions = model.predict(X)
-        confidences = np.max(predictions, axis=1)
-        predicted_temp = np.argmax(predictions, axis=1)
-        predicted_indices = np.where(confidences >= threshold, predicted_temp, 3)  # 3 = Normal
-        predicted_classes = [self.label_mapping[i] for i in predicted_indices]
-        print(f"[Classifier] Predições realizadas com sucesso.\n{predicted_classes}")
+    def predict(self, X, threshold: float = 0.7):
+        if self.model.preprocessor is None:
+            # Sem artefatos do treino: comportamento antigo, escala ajustada no próprio lote
+            scaler = preprocessing.StandardScaler()
+            X = scaler.fit_transform(X)
+        predictions = self.model.predict_proba(X)
+        predicted_classes, _ = labels_from_probabilities(predictions, threshold)
+        print(f"[Classifier] Predições realizadas com sucesso: {dict(Counter(predicted_classes))}")
         return predicted_classes
 
-    def save_malicious_predictions(self, original_df: pd.DataFrame, predicted_classes: list):
+    def save_malicious_predictions(self, original_df: pd.DataFrame, predicted_classes: list, marca: tuple = None):
+        """
+        Salva os fluxos maliciosos e, na mesma transação, avança a marca d'água para marca,
+        de modo que um bloco nunca fica salvo sem a marca d'água (ou vice-versa).
+        Retorna (inseridos, ignorados); ignorados são flow_ids que já estavam em classificados.
+        """
         original_df["class"] = predicted_classes
         maliciosos = original_df[original_df["class"].isin(MALICIOUS_CLASSES)]
-
-        if maliciosos.empty:
-            print("[Classifier] Nenhum tráfego malicioso detectado.")
-            return
+        inseridos = 0
 
         try:
-            maliciosos.to_sql("classificados", self.engine, if_exists="append", index=False, method='multi')
-            print(f"[Classifier] {len(maliciosos)} registros maliciosos salvos na tabela 'classificados'.")
+            with self.engine.begin() as conn:
+                if not maliciosos.empty:
+                    # Com a marca d'água, um flow_id repetido não pode abortar o bloco (ficaria preso nele)
+                    if conn.dialect.name == "postgresql":
+                        inseridos = copy_ignore_duplicates(conn, maliciosos)
+                    else:
+                        # chunksize: um INSERT por bloco de 1000 linhas (o SQLite limita o número de parâmetros)
+                        inseridos = maliciosos.to_sql("classificados", conn, if_exists="append", index=False,
+                                                      method=insert_ignore_duplicates, chunksize=1000)
+                if marca is not None:
+                    self.save_watermark(conn, marca)
         except Exception as e:
             raise RuntimeError(f"[Classifier] Erro ao salvar predições: {e}")
 
+        ignorados = len(maliciosos) - inseridos
+        if maliciosos.empty:
+            print("[Classifier] Nenhum tráfego malicioso detectado.")
+        else:
+            print(f"[Classifier] {inseridos} registros maliciosos salvos na tabela 'classificados' "
+                  f"({ignorados} já existentes ignorados).")
+        return inseridos, ignorados
+
     def run(self):
-        print("[Classifier] Carregando dados do banco...")
-        df = self.load_data()
-        if df is None:
-            print("[Classifier] Nenhum dado encontrado. Encerrando.")
-            return
+        """Classifica, em blocos de batch_size, todos os fluxos após a marca d'água até alcançar o fim de trafego"""
+        marca = self.load_watermark()
+        total = 0
 
-        print("[Classifier] Pré-processando dados...")
-        X, df_original = self.preprocess_data(df)
+        while True:
+            print(f"[Classifier] Carregando dados do banco ((xid, id) > {marca})...")
+            df = self.load_data(marca)
+            if df is None:
+                break
 
-        print("[Classifier] Carregando modelo...")
-        model = self.load_model()
-        model.summary()
-        print("[Classifier] Modelo carregado com sucesso.")
+            marca = self.pop_watermark(df)
 
-        print("[Classifier] Realizando predições...")
-        predictions = self.predict(model, X)
+            print("[Classifier] Pré-processando dados...")
+            X, df_original = self.preprocess_data(df)
 
-        print("[Classifier] Salvando predições maliciosas...")
-        self.save_malicious_predictions(df, predictions)
+            print("[Classifier] Realizando predições...")
+            predictions = self.predict(X)
 
-if __name__ == "__main__":
-    sleep_time = int(os.getenv("SLEEP_TIME", 60))
+            print("[Classifier] Salvando predições maliciosas...")
+            self.save_malicious_predictions(df, predictions, marca=marca)
+            total += len(df)
+
+            if len(df) < self.batch_size:
+                break
+
+        print(f"[Classifier] {total} fluxos classificados nesta execução (marca d'água: {marca}).")
+
+def executar_worker(model_path: str, sleep_time: int, shard: int = 0, shards: int = 1):
+    """Laço de um classificador (ou de um shard): modelo e engine são criados uma vez e reutilizados"""
+    prefixo = "" if shards == 1 else f"[Shard {shard}/{shards}] "
+    classifier = None
     while(True):
         try:
-            model_path = os.getenv("MODEL_PATH", "/models/flower-uiot.keras")
-            classifier = Classifier(model_path)
+            if classifier is None:
+                classifier = Classifier(model_path, shard=shard, shards=shards)
+            else:
+                classifier.model.reload_if_changed()
             classifier.run()
-            print(f"[Classifier] Aguardando {sleep_time} segundos para a próxima execução")
+            print(f"{prefixo}[Classifier] Aguardando {sleep_time} segundos para a próxima execução")
             time.sleep(sleep_time)
-            print("[Classifier] Encerrando o Classifier.")
         except Exception as e:
-            print(f"[Classifier] Erro: {e}")
+            print(f"{prefixo}[Classifier] Erro: {e}")
             time.sleep(5)
-    
\ No newline at end of file
+
+
+def executar_shards(model_path: str, sleep_time: int, shards: int, shard_ids: list):
+    """Um processo por shard (spawn: nada do TensorFlow é herdado por fork); reinicia os que morrerem"""
+    import multiprocessing
+
+    contexto = multiprocessing.get_context("spawn")
+    processos = {}
+    while True:
+        for shard in shard_ids:
+            processo = processos.get(shard)
+            if processo is None or not processo.is_alive():
+                if processo is not None:
+                    print(f"[Classifier] Worker do shard {shard} terminou (código {processo.exitcode}), reiniciando...")
+                processo = contexto.Process(target=executar_worker, args=(model_path, sleep_time, shard, shards),
+                                            name=f"classifier-{shard}", daemon=True)
+                processo.start()
+                processos[shard] = processo
+        time.sleep(5)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Classificador do NIDS")
+    parser.add_argument("--shards", type=int, default=SHARDS, help="Total de shards de trafego (todos os nós)")
+    parser.add_argument("--shard-ids", default=SHARD_IDS,
+                        help="Shards executados neste nó, separados por vírgula (padrão: todos)")
+    args = parser.parse_args()
+
+    sleep_time = int(os.getenv("SLEEP_TIME", 60))
+    model_path = os.getenv("MODEL_PATH", "/models/flower-uiot.keras")
+    shard_ids = [int(i) for i in args.shard_ids.split(",") if i.strip()] or list(range(args.shards))
+    if args.shards < 1 or any(not 0 <= i < args.shards for i in shard_ids):
+        parser.error(f"shards inválidos: {shard_ids} de {args.shards}")
+
+    if args.shards == 1:
+        executar_worker(model_path, sleep_time)
+    elif len(shard_ids) == 1:
+        executar_worker(model_path, sleep_time, shard_ids[0], args.shards)
+    else:
+        executar_shards(model_path, sleep_time, args.shards, shard_ids)
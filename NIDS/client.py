@@ -1,8 +1,13 @@
 import argparse
+import hashlib
+import json
 import os
+import shutil
+import tempfile
 from pathlib import Path
 
 import flwr as fl
+import compression
 import tensorflow as tf
 from tensorflow import keras
 from flwr_datasets import FederatedDataset
@@ -24,14 +29,42 @@ from sklearn.metrics import confusion_matrix
 # Make TensorFlow logs less verbose
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 
+CATEGORICAL_COLUMNS = ["src_ip", "dest_ip", "proto"]
+FEATURE_COLUMNS = [
+    "flow_id", "src_ip", "dest_ip", "src_port", "dest_port", "proto", "hour", "minute", "seconds",
+    "severity", "pkts_toserver", "pkts_toclient", "bytes_toserver", "bytes_toclient"
+]
+# Training data: labeled CSV or Parquet (a file or a data=YYYY-MM-DD partitioned directory) with the
+# feature columns plus "class". The ingester's Parquet spill has no labels and cannot be used as is.
+TRAIN_DATA_PATH = os.getenv("TRAIN_DATA_PATH", "./trainmodel.csv")
+
+# Resampling/split configuration; part of the dataset cache key
+OVERSAMPLING = {0: 3400, 1: 3300, 3: 2900, 4: 2800}
+UNDERSAMPLING = {2: 6500}
+TEST_SIZE = 0.25
+SPLIT_SEED = 80
+# Prepared train/test arrays are cached here, keyed by input file hash + configuration above.
+# Bump DATASET_CACHE_VERSION when the preparation changes in a way the key does not capture.
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", ".cache/datasets")
+DATASET_CACHE_VERSION = 1
+# Streaming (out-of-core) training: rows are read TRAIN_CHUNK_ROWS at a time, so memory is
+# bounded by the chunk size instead of the dataset size. Class weights replace SMOTE.
+TRAIN_STREAMING = os.getenv("TRAIN_STREAMING", "0") == "1"
+TRAIN_CHUNK_ROWS = int(os.getenv("TRAIN_CHUNK_ROWS", 100000))
+# This client's fitted scaler and vocabularies (used for received_file.csv). The copy the classifier
+# reads is written by server.py next to the deployed model, at classifier.preprocessing_path_for(MODEL_PATH)
+PREPROCESSING_PATH = os.getenv("CLIENT_PREPROCESSING_PATH", "models/client.preprocessing.json")
+
 
 # Define Flower client
 class CifarClient(fl.client.NumPyClient):
-    def __init__(self, model, x_train, y_train, x_test, y_test,new):
+    def __init__(self, model, x_train, y_train, x_test, y_test,new, data=None):
         self.model = model
         self.new = new
         self.x_train, self.y_train = x_train, y_train
         self.x_test, self.y_test = x_test, y_test
+        # StreamingDataset: when set, x_*/y_* are unused and batches come from tf.data
+        self.data = data
         self.y_pred = 0
         self.y_pred_bool = 0
         self.y_pred_b = 0
@@ -57,21 +90,35 @@ class CifarClient(fl.client.NumPyClient):
         validation_split: float = config["validation_split"]
 
         # Train the model using hyperparameters from config
-        history = self.model.fit(
-            self.x_train,
-            self.y_train,
-            batch_size,
-            epochs,
-            validation_split=validation_split,
-        )
-        self.y_pred = self.model.predict(self.x_test, batch_size=32, verbose=2)
-        self.y_pred_bool = np.argmax(self.y_pred, axis=-1)
-        confusion = confusion_matrix(self.y_test, self.y_pred_bool)
+        if self.data is None:
+            history = self.model.fit(
+                self.x_train,
+                self.y_train,
+                batch_size,
+                epochs,
+                validation_split=validation_split,
+            )
+            self.y_pred = self.model.predict(self.x_test, batch_size=32, verbose=2)
+            y_test = self.y_test
+            self.y_pred_bool = np.argmax(self.y_pred, axis=-1)
+            confusion = confusion_matrix(y_test, self.y_pred_bool)
+            weights = None
+        else:
+            # validation_split needs in-memory arrays; the streamed test split is used instead
+            history = self.model.fit(
+                self.data.dataset(batch_size),
+                epochs=epochs,
+                validation_data=self.data.dataset(batch_size, test=True),
+            )
+            confusion = self.data.confusion(self.model, 32)
+            # One weighted sample per confusion cell gives the same report as the per-row labels
+            y_test, self.y_pred_bool = np.nonzero(confusion)
+            weights = confusion[y_test, self.y_pred_bool]
         print('Confusion Matrix\n')
         print(confusion)
 
         print('\nClassification Report\n')
-        print(classification_report(self.y_test, self.y_pred_bool, target_names = ['Botnet', 'Bruteforce', 'DoS', 'Normal', 'Scan']))
+        print(classification_report(y_test, self.y_pred_bool, labels=range(5), target_names = ['Botnet', 'Bruteforce', 'DoS', 'Normal', 'Scan'], sample_weight=weights))
 
         self.y_pred = self.model.predict(self.new, batch_size=32)
         self.y_pred = np.argmax(self.y_pred, axis=-1)
@@ -81,14 +128,20 @@ class CifarClient(fl.client.NumPyClient):
             for line in self.y_pred:
                 f.write(f"{line}\n")
 
-        # Return updated model parameters and results
-        parameters_prime = self.model.get_weights()
-        num_examples_train = len(self.x_train)
+        # Return updated model parameters and results, encoded as requested by the server
+        mode = config.get("compression", "none")
+        delta = bool(config.get("delta", False))
+        parameters_prime = compression.encode(
+            self.model.get_weights(), mode, reference=parameters if delta else None
+        )
+        num_examples_train = len(self.x_train) if self.data is None else self.data.num_train
         results = {
             "loss": history.history["loss"][0],
             "accuracy": history.history["accuracy"][0],
             "val_loss": history.history["val_loss"][0],
             "val_accuracy": history.history["val_accuracy"][0],
+            "compression": mode,
+            "delta": delta,
         }
         return parameters_prime, num_examples_train, results
 
@@ -102,14 +155,17 @@ class CifarClient(fl.client.NumPyClient):
         steps: int = config["val_steps"]
 
         # Evaluate global model parameters on the local test data and return results
-        loss, accuracy = self.model.evaluate(self.x_test, self.y_test, 32, steps=steps)
+        if self.data is None:
+            loss, accuracy = self.model.evaluate(self.x_test, self.y_test, 32, steps=steps)
+        else:
+            loss, accuracy = self.model.evaluate(self.data.dataset(32, test=True), steps=steps)
         acc = accuracy * 100
         lss = loss * 100
         with open('results/accloss.txt', 'w') as f:
             f.write(f"{acc}\n")
             f.write(f"{lss}\n")
 
-        num_examples_test = len(self.x_test)
+        num_examples_test = len(self.x_test) if self.data is None else self.data.num_test
         return loss, num_examples_test, {"accuracy": accuracy}
 
 
@@ -133,6 +189,8 @@ def main() -> None:
     # )
     parser.add_argument("--partition",type=int, choices=range(0, 10), required=True)
     parser.add_argument("--address",type=str,required=True)
+    parser.add_argument("--streaming", action="store_true", default=TRAIN_STREAMING,
+                        help="Stream training batches from chunked files instead of loading the dataset in memory")
     args = parser.parse_args()
 
     # Load and compile Keras model
@@ -152,19 +210,22 @@ def main() -> None:
     model.compile("adam", "sparse_categorical_crossentropy", metrics=["accuracy"])
 
     # Load a subset of CIFAR-10 to simulate the local data partition
+    data = None
+    if args.streaming:
+        data = StreamingDataset(TRAIN_DATA_PATH, preprocessing_path=PREPROCESSING_PATH)
+        x_train = y_train = x_test = y_test = None
+    else:
+        x_train, y_train, x_test, y_test = load_partition(preprocessing_path=PREPROCESSING_PATH)
     new = pd.read_csv('./received_file.csv', on_bad_lines='skip')
-    new = encode(new)
-    scaler = preprocessing.StandardScaler()
-    new=scaler.fit_transform(new)
+    new = apply_preprocessing(new, load_preprocessing(PREPROCESSING_PATH))
     new = new.reshape(new.shape[0], new.shape[1], 1)
-    x_train, y_train, x_test, y_test = load_partition()
 
     # if args.toy:
     #     x_train, y_train = x_train[:10], y_train[:10]
     #     x_test, y_test = x_test[:10], y_test[:10]
 
     # Start Flower client
-    client = CifarClient(model, x_train, y_train, x_test, y_test,new).to_client()
+    client = CifarClient(model, x_train, y_train, x_test, y_test,new, data=data).to_client()
 
     fl.client.start_client(
         server_address=args.address,
@@ -173,48 +234,351 @@ def main() -> None:
     )
 
 
-def load_partition():
-    """Load 1/10th of the training and test data to simulate a partition."""
-    # Download and partition dataset
-    out = pd.read_csv('./trainmodel.csv', on_bad_lines='skip')
-    out = encode(out)
+def load_partition(preprocessing_path=None, use_cache=True):
+    """Load 1/10th of the training and test data to simulate a partition.
+
+    The prepared arrays are cached on disk and memory-mapped on later calls (client and
+    server share the cache), so resampling and scaling only run when the input data or
+    the sampling configuration change.
+
+    If preprocessing_path is given, the fitted scaler and categorical vocabularies
+    are exported there so inference applies exactly the same transformation.
+    """
+    key = dataset_cache_key(TRAIN_DATA_PATH) if use_cache else None
+    cached = load_cached_dataset(key) if key else None
+    if cached is None:
+        arrays, artifacts = prepare_dataset(TRAIN_DATA_PATH)
+        if key:
+            save_cached_dataset(key, arrays, artifacts)
+    else:
+        print(f"Using cached dataset {key}")
+        arrays, artifacts = cached
+    if preprocessing_path:
+        save_preprocessing(preprocessing_path, artifacts)
+
+    # fds = FederatedDataset(dataset="cifar10", partitioners={"train": 10})
+    # partition = fds.load_partition(idx)
+    # partition.set_format("numpy")
+
+    # # Divide data on each node: 80% train, 20% test
+    # partition = partition.train_test_split(test_size=0.2, seed=42)
+    # x_train, y_train = partition["train"]["img"] / 255.0, partition["train"]["label"]
+    # x_test, y_test = partition["test"]["img"] / 255.0, partition["test"]["label"]
+    return arrays
+
+
+def prepare_dataset(path):
+    """Read, encode, resample, split and scale the training data.
+
+    Returns ((x_train, y_train, x_test, y_test), preprocessing artifacts).
+    """
+    out = read_dataset(path, FEATURE_COLUMNS + ["class"])
+    vocabularies = fit_vocabularies(out)
+    out = encode(out, vocabularies)
     out['class'] = out['class'].astype('category')
     out['class'] = out['class'].cat.codes
     x = out.drop('class', axis=1)
+    columns = list(x.columns)
     y = out.iloc[:,-1].values
-    over = SMOTE(sampling_strategy={0: 3400, 1: 3300, 3: 2900, 4: 2800})
-    under = RandomUnderSampler(sampling_strategy={2: 6500})
+    over = SMOTE(sampling_strategy=OVERSAMPLING)
+    under = RandomUnderSampler(sampling_strategy=UNDERSAMPLING)
     pipeline = Pipeline(steps=[('u', under),('o', over)])
     x, y = pipeline.fit_resample(x, y)
-    x_train, x_test, y_train, y_test = train_test_split(x,y,test_size=0.25,random_state=80)
-    counter = Counter(y_train)
+    x_train, x_test, y_train, y_test = train_test_split(x,y,test_size=TEST_SIZE,random_state=SPLIT_SEED)
     scaler = preprocessing.StandardScaler()
     x_train=scaler.fit_transform(x_train)
     x_test=scaler.transform(x_test)
     x_train = x_train.reshape(x_train.shape[0], x_train.shape[1], 1)
     x_test = x_test.reshape(x_test.shape[0], x_test.shape[1], 1)
+    return (x_train, y_train, x_test, y_test), preprocessing_artifacts(columns, scaler, vocabularies)
+
+
+def hash_dataset(path):
+    """blake2b of the dataset contents (every data file, in order, for Parquet directories)."""
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path)
+            for name in names
+            # Skip in-progress (.tmp) and marker (_SUCCESS) files
+            if not name.startswith((".", "_"))
+        )
+    else:
+        files = [path]
+    digest = hashlib.blake2b(digest_size=16)
+    for file in files:
+        digest.update(os.path.relpath(file, path).encode())
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dataset_cache_key(path):
+    config = {
+        "version": DATASET_CACHE_VERSION,
+        "columns": FEATURE_COLUMNS,
+        "oversampling": OVERSAMPLING,
+        "undersampling": UNDERSAMPLING,
+        "test_size": TEST_SIZE,
+        "split_seed": SPLIT_SEED,
+    }
+    config_hash = hashlib.blake2b(json.dumps(config, sort_keys=True).encode(), digest_size=8).hexdigest()
+    return f"{hash_dataset(path)}-{config_hash}"
+
+
+CACHED_ARRAYS = ("x_train", "y_train", "x_test", "y_test")
+
+
+def load_cached_dataset(key):
+    """Memory-map the cached arrays for key; None if there is no complete cache entry."""
+    directory = os.path.join(DATASET_CACHE_DIR, key)
+    try:
+        with open(os.path.join(directory, "preprocessing.json")) as f:
+            artifacts = json.load(f)
+        arrays = tuple(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in CACHED_ARRAYS)
+    except (FileNotFoundError, ValueError):
+        return None
+    return arrays, artifacts
+
+
+def save_cached_dataset(key, arrays, artifacts):
+    """Write the entry to a temporary directory and rename it into place, so readers never see partial files."""
+    os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=DATASET_CACHE_DIR)
+    try:
+        os.chmod(tmp, 0o755)
+        for name, array in zip(CACHED_ARRAYS, arrays):
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        with open(os.path.join(tmp, "preprocessing.json"), "w") as f:
+            json.dump(artifacts, f)
+        os.replace(tmp, os.path.join(DATASET_CACHE_DIR, key))
+        print(f"Dataset cached as {key}")
+    except OSError:
+        # Another process stored the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def iter_chunks(path, columns, chunk_rows=TRAIN_CHUNK_ROWS):
+    """Yield the dataset as DataFrames of at most chunk_rows rows (CSV or Parquet)."""
+    if is_parquet(path):
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(path, format="parquet", partitioning="hive")
+        check_columns(path, dataset.schema.names, columns)
+        for batch in dataset.to_batches(columns=columns, batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_rows, on_bad_lines='skip'):
+            yield chunk[columns]
+
+
+def test_mask(chunk_index, size):
+    """Deterministic per-chunk train/test split (True = test row)."""
+    return np.random.default_rng([SPLIT_SEED, chunk_index]).random(size) < TEST_SIZE
+
+
+def encode_chunk(chunk, vocabularies, classes):
+    """Categorical codes for features and labels; unknown or missing labels become -1."""
+    chunk = encode(chunk.copy(), vocabularies)
+    labels = chunk["class"].astype(str).where(chunk["class"].notna())
+    y = pd.Categorical(labels, categories=classes).codes
+    return chunk[FEATURE_COLUMNS].to_numpy(dtype=np.float64), y
+
+
+def streaming_stats(path, chunk_rows=TRAIN_CHUNK_ROWS):
+    """Fit vocabularies, scaler and class counts with two passes over the chunks.
+
+    Only the distinct categorical values are kept in memory, never the rows.
+    """
+    values = {col: set() for col in CATEGORICAL_COLUMNS}
+    classes = set()
+    for chunk in iter_chunks(path, FEATURE_COLUMNS + ["class"], chunk_rows):
+        for col in CATEGORICAL_COLUMNS:
+            values[col].update(chunk[col].dropna().astype(str).unique())
+        classes.update(chunk["class"].dropna().astype(str).unique())
+    vocabularies = {col: sorted(v) for col, v in values.items()}
+    classes = sorted(classes)
 
-    # fds = FederatedDataset(dataset="cifar10", partitioners={"train": 10})
-    # partition = fds.load_partition(idx)
-    # partition.set_format("numpy")
+    scaler = preprocessing.StandardScaler()
+    train_counts = np.zeros(len(classes), dtype=np.int64)
+    test_counts = np.zeros(len(classes), dtype=np.int64)
+    for i, chunk in enumerate(iter_chunks(path, FEATURE_COLUMNS + ["class"], chunk_rows)):
+        x, y = encode_chunk(chunk, vocabularies, classes)
+        test = test_mask(i, len(y))
+        train = ~test & (y >= 0)
+        if train.any():
+            scaler.partial_fit(x[train])
+        train_counts += np.bincount(y[train], minlength=len(classes))
+        test_counts += np.bincount(y[test & (y >= 0)], minlength=len(classes))
+    return {
+        "preprocessing": preprocessing_artifacts(FEATURE_COLUMNS, scaler, vocabularies),
+        "classes": classes,
+        "train_counts": train_counts.tolist(),
+        "test_counts": test_counts.tolist(),
+    }
+
+
+def load_streaming_stats(path, chunk_rows=TRAIN_CHUNK_ROWS):
+    """streaming_stats, cached next to the prepared datasets under the same kind of key."""
+    cache_path = os.path.join(DATASET_CACHE_DIR, f"{dataset_cache_key(path)}-stream{chunk_rows}.json")
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        pass
+    stats = streaming_stats(path, chunk_rows)
+    os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+    with open(cache_path + ".tmp", "w") as f:
+        json.dump(stats, f)
+    os.replace(cache_path + ".tmp", cache_path)
+    return stats
+
+
+class StreamingDataset:
+    """Out-of-core train/test data: chunks are read, encoded, scaled, shuffled and batched on the fly.
+
+    Class imbalance is handled with per-sample weights (inverse class frequency) instead of SMOTE,
+    which would need the whole dataset in memory.
+    """
+
+    def __init__(self, path, chunk_rows=TRAIN_CHUNK_ROWS, preprocessing_path=None):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        stats = load_streaming_stats(path, chunk_rows)
+        self.artifacts = stats["preprocessing"]
+        self.classes = stats["classes"]
+        train_counts = np.asarray(stats["train_counts"], dtype=np.float64)
+        self.num_train = int(train_counts.sum())
+        self.num_test = int(sum(stats["test_counts"]))
+        present = train_counts > 0
+        self.class_weights = np.zeros(len(train_counts), dtype=np.float32)
+        self.class_weights[present] = self.num_train / (present.sum() * train_counts[present])
+        if preprocessing_path:
+            save_preprocessing(preprocessing_path, self.artifacts)
+
+    def _batches(self, test, batch_size):
+        mean = np.asarray(self.artifacts["mean"])
+        scale = np.asarray(self.artifacts["scale"])
+        rng = np.random.default_rng()
+        for i, chunk in enumerate(iter_chunks(self.path, FEATURE_COLUMNS + ["class"], self.chunk_rows)):
+            x, y = encode_chunk(chunk, self.artifacts["vocabularies"], self.classes)
+            keep = (test_mask(i, len(y)) == test) & (y >= 0)
+            x = ((x[keep] - mean) / scale).astype(np.float32)[..., np.newaxis]
+            y = y[keep].astype(np.int32)
+            # Shuffle within the chunk for training only
+            order = np.arange(len(y)) if test else rng.permutation(len(y))
+            for start in range(0, len(y), batch_size):
+                idx = order[start:start + batch_size]
+                if test:
+                    yield x[idx], y[idx]
+                else:
+                    yield x[idx], y[idx], self.class_weights[y[idx]]
+
+    def dataset(self, batch_size, test=False):
+        x_spec = tf.TensorSpec((None, len(self.artifacts["columns"]), 1), tf.float32)
+        if test:
+            signature = (x_spec, tf.TensorSpec((None,), tf.int32))
+        else:
+            signature = (x_spec, tf.TensorSpec((None,), tf.int32), tf.TensorSpec((None,), tf.float32))
+        return tf.data.Dataset.from_generator(
+            lambda: self._batches(test, batch_size), output_signature=signature
+        ).prefetch(tf.data.AUTOTUNE)
+
+    def confusion(self, model, batch_size):
+        """Confusion matrix of the test split, accumulated batch by batch.
+
+        Labels and predictions are consumed with each batch, so memory does not grow with the test split.
+        """
+        n = model.output_shape[-1]
+        total = np.zeros((n, n), dtype=np.int64)
+        for x, y in self._batches(True, batch_size):
+            y_pred = np.argmax(model.predict_on_batch(x), axis=-1)
+            total += confusion_matrix(y, y_pred, labels=range(n))
+        return total
+
+
+def is_parquet(path):
+    return os.path.isdir(path) or path.endswith(".parquet")
+
+
+def check_columns(path, available, columns):
+    missing = [c for c in columns if c not in available]
+    if "class" in missing:
+        raise ValueError(
+            f"{path} has no 'class' column: training needs labeled data "
+            "(the ingester's Parquet spill is unlabeled and only usable for benchmarks)"
+        )
+    if missing:
+        raise ValueError(f"{path} is missing columns {missing}")
+
+
+def read_dataset(path, columns=None):
+    """Read a CSV or Parquet dataset.
+
+    Parquet is read with column projection (only `columns` are decoded) and memory mapping,
+    which skips CSV parsing entirely on repeated loads.
+    """
+    if not is_parquet(path):
+        return pd.read_csv(path, on_bad_lines='skip')
+    import pyarrow.parquet as pq
+
+    if columns is not None:
+        check_columns(path, set(pq.ParquetDataset(path).schema.names), columns)
+    return pd.read_parquet(path, columns=columns, memory_map=True)
+
+
+def fit_vocabularies(out):
+    """Sorted categories of each categorical column (same order as astype('category'))."""
+    return {col: sorted(out[col].dropna().astype(str).unique()) for col in CATEGORICAL_COLUMNS}
 
-    # # Divide data on each node: 80% train, 20% test
-    # partition = partition.train_test_split(test_size=0.2, seed=42)
-    # x_train, y_train = partition["train"]["img"] / 255.0, partition["train"]["label"]
-    # x_test, y_test = partition["test"]["img"] / 255.0, partition["test"]["label"]
-    return x_train, y_train, x_test, y_test
 
-def encode(out):
-    out['src_ip'] = out['src_ip'].astype('category')
-    out['dest_ip'] = out['dest_ip'].astype('category')
-    out['proto'] = out['proto'].astype('category')
-    out['src_ip'] = out['src_ip'].cat.codes
-    out['dest_ip'] = out['dest_ip'].cat.codes
-    out['proto'] = out['proto'].cat.codes
+def encode(out, vocabularies=None):
+    """Replace categorical columns by their codes; values missing from vocabularies become -1."""
+    if vocabularies is None:
+        vocabularies = fit_vocabularies(out)
+    for col in CATEGORICAL_COLUMNS:
+        values = out[col].astype(str).where(out[col].notna())
+        out[col] = pd.Categorical(values, categories=vocabularies[col]).codes
 
     return out
 
 
+def preprocessing_artifacts(columns, scaler, vocabularies):
+    return {
+        "columns": columns,
+        "mean": scaler.mean_.tolist(),
+        "scale": scaler.scale_.tolist(),
+        "vocabularies": vocabularies,
+    }
+
+
+def export_preprocessing(path, columns, scaler, vocabularies):
+    """Save feature columns, StandardScaler mean/scale and vocabularies as JSON."""
+    save_preprocessing(path, preprocessing_artifacts(columns, scaler, vocabularies))
+
+
+def save_preprocessing(path, artifacts):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(artifacts, f)
+    os.replace(tmp, path)
+    print(f"Preprocessing artifacts saved to {path}")
+
+
+def load_preprocessing(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def apply_preprocessing(df, artifacts):
+    """Apply the training preprocessing (categorical codes + scaling) to new data."""
+    df = encode(df.copy(), artifacts["vocabularies"])
+    x = df[artifacts["columns"]].to_numpy(dtype=np.float64)
+    return (x - np.asarray(artifacts["mean"])) / np.asarray(artifacts["scale"])
+
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,47 @@
+# Weight encoding for federated rounds: optional delta against the global weights plus quantization.
+# The client encodes get_weights() with `encode` and SaveModelStrategy restores it with `decode`
+# before aggregating. The delta reference is the global model sent for the round, which both sides hold.
+from typing import List, Optional
+
+import numpy as np
+
+MODES = ("none", "float16", "int8")
+
+
+def encode(weights: List[np.ndarray], mode: str = "none", reference: Optional[List[np.ndarray]] = None) -> List[np.ndarray]:
+    """Encode a weight list; int8 appends one float32 array with the per-tensor scales."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown compression mode: {mode}")
+    tensors = [np.asarray(w, dtype=np.float32) for w in weights]
+    if reference is not None:
+        tensors = [w - np.asarray(r, dtype=np.float32) for w, r in zip(tensors, reference)]
+
+    if mode == "none":
+        return tensors
+    if mode == "float16":
+        return [t.astype(np.float16) for t in tensors]
+
+    # Symmetric per-tensor int8 quantization
+    scales = np.array([np.abs(t).max() / 127 if t.size else 0.0 for t in tensors], dtype=np.float32)
+    scales[scales == 0] = 1.0
+    quantized = [np.clip(np.rint(t / s), -127, 127).astype(np.int8) for t, s in zip(tensors, scales)]
+    return quantized + [scales]
+
+
+def decode(tensors: List[np.ndarray], mode: str = "none", reference: Optional[List[np.ndarray]] = None) -> List[np.ndarray]:
+    """Inverse of `encode`; always returns float32 weights."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown compression mode: {mode}")
+    if mode == "int8":
+        scales = tensors[-1]
+        weights = [q.astype(np.float32) * s for q, s in zip(tensors[:-1], scales)]
+    else:
+        weights = [np.asarray(t, dtype=np.float32) for t in tensors]
+
+    if reference is not None:
+        weights = [w + np.asarray(r, dtype=np.float32) for w, r in zip(weights, reference)]
+    return weights
+
+
+def nbytes(tensors: List[np.ndarray]) -> int:
+    return int(sum(np.asarray(t).nbytes for t in tensors))
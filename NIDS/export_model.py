@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from classifier import BACKENDS, backend_path_for
+
+MODEL_PATH = os.getenv("MODEL_PATH", "/models/flower-uiot.keras")
+# Camadas que o backend numpy sabe executar
+CAMADAS_SUPORTADAS = {"InputLayer", "Conv1D", "MaxPooling1D", "MaxPool1D", "Flatten", "Dense", "Dropout"}
+
+
+def exportar_npz(model, destino: str):
+    """Arquitetura (JSON) e pesos em um único .npz para o backend numpy"""
+    camadas = []
+    pesos = {}
+    for i, layer in enumerate(model.layers):
+        tipo = type(layer).__name__
+        if tipo not in CAMADAS_SUPORTADAS:
+            raise ValueError(f"[Export] Camada não suportada no backend numpy: {tipo}")
+        config = layer.get_config()
+        chaves = []
+        for j, w in enumerate(layer.get_weights()):
+            chave = f"w{i}_{j}"
+            pesos[chave] = w
+            chaves.append(chave)
+        camadas.append({
+            "type": tipo,
+            "config": {k: config.get(k) for k in ("activation", "padding", "strides", "pool_size")},
+            "weights": chaves,
+        })
+    arquitetura = {
+        "input_shape": list(model.input_shape[1:]),
+        "output_dim": model.output_shape[-1],
+        "layers": camadas,
+    }
+    tmp = destino + ".tmp.npz"
+    np.savez(tmp, architecture=np.array(json.dumps(arquitetura)), **pesos)
+    os.replace(tmp, destino)
+    print(f"[Export] {destino} gerado.")
+
+
+def exportar_tflite(model, destino: str):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(destino + ".tmp", "wb") as f:
+        f.write(converter.convert())
+    os.replace(destino + ".tmp", destino)
+    print(f"[Export] {destino} gerado.")
+
+
+def exportar_onnx(model, destino: str):
+    try:
+        import tensorflow as tf
+        import tf2onnx
+    except ImportError:
+        print("[Export] tf2onnx não instalado, exportação ONNX ignorada.")
+        return
+    spec = (tf.TensorSpec([None] + list(model.input_shape[1:]), tf.float32, name="entrada"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=destino + ".tmp")
+    os.replace(destino + ".tmp", destino)
+    print(f"[Export] {destino} gerado.")
+
+
+def exportar(model_path: str):
+    import keras
+
+    model = keras.models.load_model(model_path, compile=False)
+    exportar_npz(model, backend_path_for(model_path, "numpy"))
+    for nome, funcao in (("tflite", exportar_tflite), ("onnx", exportar_onnx)):
+        try:
+            funcao(model, backend_path_for(model_path, nome))
+        except Exception as e:
+            print(f"[Export] Falha ao exportar {nome}: {e}")
+
+
+def pico_memoria_mb() -> float:
+    """
+    Pico de RSS do processo. VmHWM é por espaço de endereçamento; ru_maxrss sobrevive ao exec
+    e herdaria o pico do processo pai que já carregou o TensorFlow.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss é em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def medir_backend(model_path: str, backend: str, amostras: str):
+    """Executado em um subprocesso por backend, para que memória e imports não se misturem"""
+    inicio = time.perf_counter()
+    instancia = BACKENDS[backend][0](backend_path_for(model_path, backend))
+    carga = time.perf_counter() - inicio
+
+    X = np.load(amostras)
+    instancia.predict(X[:1])
+    latencias = {}
+    for lote in (1, 1024):
+        tempos = []
+        for _ in range(50 if lote == 1 else 10):
+            t = time.perf_counter()
+            instancia.predict(X[:lote])
+            tempos.append(time.perf_counter() - t)
+        latencias[lote] = float(np.median(tempos) * 1000)
+
+    saida = np.concatenate([instancia.predict(X[i:i + 1024]) for i in range(0, len(X), 1024)])
+    np.save(amostras.replace(".npy", f".{backend}.npy"), saida)
+    print(json.dumps({
+        "backend": backend,
+        "carga_s": round(carga, 3),
+        "p50_lote1_ms": round(latencias[1], 3),
+        "p50_lote1024_ms": round(latencias[1024], 3),
+        "rss_mb": round(pico_memoria_mb(), 1),
+    }))
+
+
+def benchmark(model_path: str, n_amostras: int = 4096):
+    """Compara os backends disponíveis: carga, latência p50, pico de memória e divergência para o Keras"""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with np.load(backend_path_for(model_path, "numpy")) as data:
+            formato = json.loads(str(data["architecture"]))["input_shape"]
+        amostras = os.path.join(tmp, "amostras.npy")
+        rng = np.random.default_rng(0)
+        np.save(amostras, rng.standard_normal((n_amostras, *formato)).astype(np.float32))
+
+        resultados = {}
+        for backend in BACKENDS:
+            if not os.path.exists(backend_path_for(model_path, backend)):
+                continue
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), model_path, "--medir", backend, "--amostras", amostras],
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                print(f"[Benchmark] Backend {backend} indisponível: {proc.stderr.strip().splitlines()[-1:]}")
+                continue
+            resultados[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+        referencia = os.path.join(tmp, "amostras.keras.npy")
+        for backend, r in resultados.items():
+            if os.path.exists(referencia):
+                diff = np.abs(np.load(os.path.join(tmp, f"amostras.{backend}.npy")) - np.load(referencia)).max()
+                r["max_diff_keras"] = float(diff)
+            print(json.dumps(r))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta o modelo Keras para backends de inferência sem TensorFlow")
+    parser.add_argument("model_path", nargs="?", default=MODEL_PATH)
+    parser.add_argument("--benchmark", action="store_true", help="Compara os backends após exportar")
+    parser.add_argument("--medir", choices=list(BACKENDS), help=argparse.SUPPRESS)
+    parser.add_argument("--amostras", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        medir_backend(args.model_path, args.medir, args.amostras)
+    else:
+        exportar(args.model_path)
+        if args.benchmark:
+            benchmark(args.model_path)
@@ -1,7 +1,10 @@
 import psycopg2
+import argparse
 import os
+import re
 import requests
 import time
+from datetime import datetime, timedelta, timezone
 
 DB_DIR = "/flower/databases"  # Caminho do diretório onde o banco será salvo
 DB_FILE = os.path.join(DB_DIR, "nids.db")  # Caminho completo do banco
@@ -11,6 +14,10 @@ DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "nids_db")
 DB_USER = os.getenv("DB_USER", "user")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
+# Particionamento diário de trafego: partições criadas com antecedência e retenção (0 = mantém tudo)
+PARTICOES_FUTURAS = int(os.getenv("TRAFEGO_PARTICOES_FUTURAS", 7))
+RETENCAO_DIAS = int(os.getenv("TRAFEGO_RETENCAO_DIAS", 30))
+MANUTENCAO_INTERVALO = int(os.getenv("MANUTENCAO_INTERVALO", 3600))
 # Garante que o diretório do banco exista
 os.makedirs(DB_DIR, exist_ok=True)
 
@@ -35,13 +42,7 @@ def conectar(db_host=DB_HOST, db_port=DB_PORT, db_name=DB_NAME, db_user=DB_USER,
             raise Exception("Não foi possível conectar ao banco após várias tentativas")
     
 
-def inicializar_banco():
-    """Cria o banco de dados e as tabelas se ainda não existirem"""
-    conn = conectar()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS trafego (
-            id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+TRAFEGO_COLUNAS_DDL = """
             flow_id TEXT NOT NULL, 
             src_ip TEXT NOT NULL, 
             dest_ip TEXT NOT NULL, 
@@ -55,9 +56,173 @@ def inicializar_banco():
             pkts_toserver INTEGER NOT NULL, 
             pkts_toclient INTEGER NOT NULL, 
             bytes_toserver INTEGER NOT NULL, 
-            bytes_toclient INTEGER NOT NULL
+            bytes_toclient INTEGER NOT NULL"""
+
+
+def tipo_tabela(cursor, tabela):
+    """Retorna o relkind da tabela ('r' comum, 'p' particionada) ou None se não existir"""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (tabela,))
+    resultado = cursor.fetchone()
+    return resultado[0] if resultado else None
+
+
+def inicio_do_dia(dia):
+    return datetime(dia.year, dia.month, dia.day, tzinfo=timezone.utc)
+
+
+def criar_trafego_particionado(cursor):
+    """
+    trafego particionada por dia em criado_em. A chave primária precisa incluir a chave
+    de partição; o id continua vindo de uma sequência única para todas as partições.
+    """
+    cursor.execute("CREATE SEQUENCE IF NOT EXISTS trafego_id_seq AS BIGINT")
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS trafego (
+            id BIGINT NOT NULL DEFAULT nextval('trafego_id_seq'),{TRAFEGO_COLUNAS_DDL},
+            criado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+            xid BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint,
+            PRIMARY KEY (id, criado_em)
+        ) PARTITION BY RANGE (criado_em)
+    """)
+    cursor.execute("ALTER SEQUENCE trafego_id_seq OWNED BY trafego.id")
+    # Recebe linhas fora das partições diárias (ex.: manutenção parada por muito tempo)
+    cursor.execute("CREATE TABLE IF NOT EXISTS trafego_padrao PARTITION OF trafego DEFAULT")
+
+
+def migrar_trafego_legado(cursor):
+    """
+    Converte uma trafego não particionada (esquema antigo) sem copiar os dados: a tabela
+    existente é renomeada e anexada como partição única de tudo que veio antes de hoje.
+    O nome termina com o último dia coberto, para que a retenção a descarte normalmente.
+    """
+    hoje = datetime.now(timezone.utc).date()
+    legado = f"trafego_legado_{hoje - timedelta(days=1):%Y%m%d}"
+    print(f"[init_db] Migrando trafego para tabela particionada (dados antigos em {legado})...")
+
+    cursor.execute(f"ALTER TABLE trafego RENAME TO {legado}")
+    # A chave primária (id, criado_em) do pai é recriada na partição durante o ATTACH
+    cursor.execute(f"ALTER TABLE {legado} DROP CONSTRAINT trafego_pkey")
+    cursor.execute(f"ALTER TABLE {legado} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+    # Reescreve a tabela uma única vez: as colunas das partições precisam ter o mesmo tipo do pai
+    cursor.execute(f"ALTER TABLE {legado} ALTER COLUMN id TYPE BIGINT")
+    cursor.execute(f"ALTER TABLE {legado} ADD COLUMN criado_em TIMESTAMPTZ NOT NULL DEFAULT '-infinity'")
+    cursor.execute(f"ALTER TABLE {legado} ADD COLUMN xid BIGINT NOT NULL DEFAULT 0")
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {legado}")
+    ultimo_id = cursor.fetchone()[0]
+
+    criar_trafego_particionado(cursor)
+    cursor.execute("SELECT setval('trafego_id_seq', %s)", (max(ultimo_id, 1),))
+    cursor.execute(
+        f"ALTER TABLE trafego ATTACH PARTITION {legado} FOR VALUES FROM (MINVALUE) TO (%s)",
+        (inicio_do_dia(hoje),)
+    )
+
+
+def criar_particao(cursor, dia):
+    """
+    Cria a partição do dia. Se a partição padrão já tiver linhas nesse intervalo, o CREATE
+    falharia: a padrão é desanexada, a partição criada, as linhas movidas e a padrão reanexada.
+    """
+    nome = f"trafego_p{dia:%Y%m%d}"
+    if tipo_tabela(cursor, nome) is not None:
+        return
+    intervalo = (inicio_do_dia(dia), inicio_do_dia(dia + timedelta(days=1)))
+
+    possui_padrao = tipo_tabela(cursor, "trafego_padrao") is not None
+    if possui_padrao:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM trafego_padrao WHERE criado_em >= %s AND criado_em < %s)", intervalo
+        )
+        possui_padrao = cursor.fetchone()[0]
+
+    if not possui_padrao:
+        cursor.execute(f"CREATE TABLE {nome} PARTITION OF trafego FOR VALUES FROM (%s) TO (%s)", intervalo)
+        return
+
+    cursor.execute("ALTER TABLE trafego DETACH PARTITION trafego_padrao")
+    cursor.execute(f"CREATE TABLE {nome} PARTITION OF trafego FOR VALUES FROM (%s) TO (%s)", intervalo)
+    cursor.execute(f"""
+        WITH movidas AS (
+            DELETE FROM trafego_padrao WHERE criado_em >= %s AND criado_em < %s RETURNING *
         )
+        INSERT INTO {nome} SELECT * FROM movidas
+    """, intervalo)
+    movidas = cursor.rowcount
+    cursor.execute("ALTER TABLE trafego ATTACH PARTITION trafego_padrao DEFAULT")
+    print(f"[init_db] {movidas} linhas movidas da partição padrão para {nome}.")
+
+
+def criar_particoes(cursor, dias_futuros=PARTICOES_FUTURAS):
+    """
+    Garante as partições diárias de hoje até dias_futuros à frente. Cada partição tem seu
+    próprio savepoint: uma falha é registrada e não impede as demais nem a retenção.
+    """
+    hoje = datetime.now(timezone.utc).date()
+    for i in range(dias_futuros + 1):
+        dia = hoje + timedelta(days=i)
+        cursor.execute("SAVEPOINT particao")
+        try:
+            criar_particao(cursor, dia)
+            cursor.execute("RELEASE SAVEPOINT particao")
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT particao")
+            print(f"[init_db] Falha ao criar a partição de {dia}: {e}")
+
+
+def aplicar_retencao(cursor, dias=RETENCAO_DIAS):
+    """Remove partições de trafego cujo último dia é anterior ao período de retenção"""
+    if dias <= 0:
+        return []
+    limite = datetime.now(timezone.utc).date() - timedelta(days=dias)
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'trafego'::regclass
     """)
+    removidas = []
+    for (nome,) in cursor.fetchall():
+        data = re.search(r"_p?(\d{8})$", nome)
+        if data and datetime.strptime(data.group(1), "%Y%m%d").date() < limite:
+            cursor.execute(f"DROP TABLE {nome}")
+            removidas.append(nome)
+    return removidas
+
+
+def manutencao_particoes(conn):
+    """Cria as próximas partições e aplica a política de retenção"""
+    cursor = conn.cursor()
+    criar_particoes(cursor)
+    conn.commit()
+    # Transação separada: problemas na criação não podem impedir a retenção
+    try:
+        removidas = aplicar_retencao(cursor)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        removidas = []
+        print(f"[init_db] Falha ao aplicar a retenção: {e}")
+    cursor.close()
+    if removidas:
+        print(f"[init_db] Partições removidas pela retenção: {', '.join(removidas)}")
+
+
+def inicializar_banco():
+    """Cria o banco de dados e as tabelas se ainda não existirem"""
+    conn = conectar()
+    cursor = conn.cursor()
+
+    tipo = tipo_tabela(cursor, "trafego")
+    if tipo is None:
+        criar_trafego_particionado(cursor)
+    elif tipo == "r":
+        migrar_trafego_legado(cursor)
+    criar_particoes(cursor)
+
+    # Transação que gravou cada fluxo, para a marca d'água do classificador. Fluxos de antes da coluna
+    # ficam com 0 (ADD COLUMN sem reescrever a tabela) e continuam ordenados só pelo id
+    cursor.execute("ALTER TABLE trafego ADD COLUMN IF NOT EXISTS xid BIGINT NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE trafego ALTER COLUMN xid SET DEFAULT pg_current_xact_id()::text::bigint")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trafego_xid_id ON trafego (xid, id)")
 
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS classificados (
@@ -81,6 +246,50 @@ def inicializar_banco():
             UNIQUE (flow_id)
         )
     """)
+
+    # Reserva (lease) dos ataques pelo watcher: até quando e por quem; bancos antigos ganham as colunas aqui
+    cursor.execute("ALTER TABLE classificados ADD COLUMN IF NOT EXISTS reservado_ate TIMESTAMPTZ")
+    cursor.execute("ALTER TABLE classificados ADD COLUMN IF NOT EXISTS reservado_por TEXT")
+
+    # Índice parcial: só contém os ataques ainda não processados, que é o que o watcher consulta
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_classificados_pendentes ON classificados (id)
+        WHERE processado = 0 AND class NOT IN ('normal', 'Benign')
+    """)
+    
+    # NOTIFY por comando (não por linha) quando entram ataques, para a API avisar o watcher;
+    # o payload é a quantidade de ataques inseridos
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION notificar_classificados() RETURNS trigger AS $$
+        DECLARE
+            total INTEGER;
+        BEGIN
+            SELECT count(*) INTO total FROM novos WHERE class NOT IN ('normal', 'Benign');
+            IF total > 0 THEN
+                PERFORM pg_notify('classificados_novos', total::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS classificados_notificar ON classificados")
+    cursor.execute("""
+        CREATE TRIGGER classificados_notificar
+        AFTER INSERT ON classificados
+        REFERENCING NEW TABLE AS novos
+        FOR EACH STATEMENT EXECUTE FUNCTION notificar_classificados()
+    """)
+
+    # Marca d'água do classificador: (xid, id) do último fluxo de trafego já classificado
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS classificador_estado (
+            nome TEXT PRIMARY KEY,
+            ultimo_xid BIGINT NOT NULL DEFAULT 0,
+            ultimo_id BIGINT NOT NULL DEFAULT 0,
+            atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    cursor.execute("ALTER TABLE classificador_estado ADD COLUMN IF NOT EXISTS ultimo_xid BIGINT NOT NULL DEFAULT 0")
     
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS usuarios (
@@ -91,8 +300,30 @@ def inicializar_banco():
     """)
 
     conn.commit()
+    manutencao_particoes(conn)
     conn.close()
     print("Banco de dados inicializado!")
 
+
+def executar_manutencao(intervalo=MANUTENCAO_INTERVALO):
+    """Laço de manutenção das partições de trafego"""
+    while True:
+        try:
+            conn = conectar()
+            manutencao_particoes(conn)
+            conn.close()
+        except Exception as e:
+            print(f"[init_db] Erro na manutenção das partições: {e}")
+        time.sleep(intervalo)
+
+
 if __name__ == "__main__":
-    inicializar_banco()    
+    parser = argparse.ArgumentParser(description="Inicialização e manutenção do banco do NIDS")
+    parser.add_argument("--manutencao", action="store_true",
+                        help="Após inicializar o banco, executa continuamente a criação de partições e a retenção de trafego")
+    args = parser.parse_args()
+
+    inicializar_banco()
+    if args.manutencao:
+        # No mesmo processo: a manutenção só começa depois da migração terminar
+        executar_manutencao()
@@ -1,9 +1,14 @@
 from pathlib import Path
 import argparse
+import concurrent.futures
+import os
+import threading
+import time
+from logging import INFO, WARNING
 from typing import Dict, Optional, Tuple, Callable, List, Tuple, Union
 from flwr.common.logger import log
-from flwr.common import Scalar, FitRes, Parameters, EvaluateRes
-from flwr.server.client_manager import ClientManager
+from flwr.common import Code, Scalar, FitRes, Parameters, EvaluateRes
+from flwr.server.client_manager import ClientManager, SimpleClientManager
 from flwr.server.client_proxy import ClientProxy
 import numpy as np
 import keras
@@ -15,9 +20,93 @@ from sklearn.model_selection import train_test_split
 from keras.models import Sequential
 from keras.layers import Flatten, Dense, Conv1D, MaxPool1D, Dropout, Input, Activation
 import client
+import compression
+from classifier import preprocessing_path_for
 from flwr_datasets import FederatedDataset
 
+# Client update encoding requested in fit_config: "none", "float16" or "int8", optionally as a
+# delta against the global weights of the round
+# The trained model replaces the one served by the classifier and the API (same MODEL_PATH); the fitted
+# preprocessing goes next to it, where classifier.NIDSModel looks for it
+MODEL_PATH = os.getenv("MODEL_PATH", "/models/flower-uiot.keras")
+PREPROCESSING_PATH = preprocessing_path_for(MODEL_PATH)
+COMPRESSION = os.getenv("FL_COMPRESSION", "none")
+DELTA = os.getenv("FL_DELTA", "0") == "1"
+# A fit round closes once QUORUM results are in (a fraction of the sampled clients if <= 1, else a
+# count) or ROUND_DEADLINE seconds have passed; 0 disables the deadline
+QUORUM = float(os.getenv("FL_QUORUM", "0.6"))
+ROUND_DEADLINE = float(os.getenv("FL_ROUND_DEADLINE", "0"))
+# Updates that arrive after their round closed are damped by (1 + staleness) ** -STALENESS_ALPHA,
+# and dropped when more than MAX_STALENESS rounds old
+STALENESS_ALPHA = float(os.getenv("FL_STALENESS_ALPHA", "0.5"))
+MAX_STALENESS = int(os.getenv("FL_MAX_STALENESS", "2"))
+# Timeout of a single client fit/evaluate call; 0 waits indefinitely
+CLIENT_TIMEOUT = float(os.getenv("FL_CLIENT_TIMEOUT", "0"))
+
 class SaveModelStrategy(fl.server.strategy.FaultTolerantFedAvg):
+    def __init__(self, *args, staleness_alpha: float = STALENESS_ALPHA, max_staleness: int = MAX_STALENESS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.staleness_alpha = staleness_alpha
+        self.max_staleness = max_staleness
+        # Global weights sent in the current round: reference for delta-encoded client updates
+        self.global_weights = None
+        # Global weights of the last rounds, the base of late updates from stragglers
+        self.round_weights: Dict[int, List[np.ndarray]] = {}
+        # Clients still training an earlier round (maintained by QuorumServer); they are not sent
+        # new instructions until that fit returns
+        self.busy_clients = set()
+
+    def configure_fit(self, server_round: int, parameters: Parameters, client_manager: ClientManager):
+        self.global_weights = fl.common.parameters_to_ndarrays(parameters)
+        self.round_weights[server_round] = self.global_weights
+        for old in [r for r in self.round_weights if r < server_round - self.max_staleness]:
+            del self.round_weights[old]
+        return self.skip_busy(super().configure_fit(server_round, parameters, client_manager))
+
+    def configure_evaluate(self, server_round: int, parameters: Parameters, client_manager: ClientManager):
+        return self.skip_busy(super().configure_evaluate(server_round, parameters, client_manager))
+
+    def skip_busy(self, instructions):
+        ready = [(proxy, ins) for proxy, ins in instructions if proxy.cid not in self.busy_clients]
+        if len(ready) < len(instructions):
+            log(INFO, "Skipping %s clients still training an earlier round", len(instructions) - len(ready))
+        return ready
+
+    def decode_results(self, server_round, results):
+        """Restore float32 weights from encoded client updates and log bytes received."""
+        decoded = []
+        received = raw = 0
+        for proxy, res in results:
+            # Round whose global weights the client trained from (set by QuorumServer)
+            base_round = int(res.metrics.get("base_round", server_round))
+            base = self.round_weights.get(base_round, self.global_weights if base_round == server_round else None)
+            if base is None:
+                log(WARNING, "Round %s: dropping update from %s, %s rounds stale",
+                    server_round, proxy.cid, server_round - base_round)
+                continue
+            mode = res.metrics.get("compression", "none")
+            reference = base if res.metrics.get("delta", False) else None
+            weights = compression.decode(fl.common.parameters_to_ndarrays(res.parameters), mode, reference)
+            staleness = server_round - base_round
+            if staleness > 0:
+                # Rebase the late update onto the current global weights, damped by its staleness
+                factor = (1 + staleness) ** -self.staleness_alpha
+                weights = [g + factor * (w - b) for g, w, b in zip(self.global_weights, weights, base)]
+            received += sum(len(t) for t in res.parameters.tensors)
+            raw += compression.nbytes(weights)
+            decoded.append((proxy, FitRes(res.status, fl.common.ndarrays_to_parameters(weights), res.num_examples, res.metrics)))
+
+        if decoded:
+            log(INFO, "Round %s: %s bytes received from %s clients (%.1f%% of float32, %s bytes)",
+                server_round, received, len(decoded), 100 * received / max(raw, 1), raw)
+            os.makedirs("results", exist_ok=True)
+            new_file = not os.path.exists("results/transport.csv")
+            with open("results/transport.csv", "a") as f:
+                if new_file:
+                    f.write("round,clients,bytes_received,bytes_float32\n")
+                f.write(f"{server_round},{len(decoded)},{received},{raw}\n")
+        return decoded
+
     def aggregate_fit(
         self,
         server_round: int,
@@ -25,6 +114,8 @@ class SaveModelStrategy(fl.server.strategy.FaultTolerantFedAvg):
         failures: List[Union[Tuple[ClientProxy, FitRes], BaseException]],
     ) -> Tuple[Optional[Parameters], Dict[str, Scalar]]:
 
+        results = self.decode_results(server_round, results)
+
         # Call aggregate_fit from base class (FedAvg) to aggregate parameters and metrics
         aggregated_parameters, aggregated_metrics = super().aggregate_fit(server_round, results, failures)
 
@@ -33,7 +124,7 @@ class SaveModelStrategy(fl.server.strategy.FaultTolerantFedAvg):
             aggregated_ndarrays: List[np.ndarray] = fl.common.parameters_to_ndarrays(aggregated_parameters)
             # Save aggregated_ndarrays
             print(f"Saving round {server_round} aggregated_ndarrays...")
-            np.savez(f"round-{server_round}-weights.npz", *aggregated_ndarrays)
+            np.savez_compressed(f"round-{server_round}-weights.npz", *aggregated_ndarrays)
 
         return aggregated_parameters, aggregated_metrics
 
@@ -69,12 +160,133 @@ class SaveModelStrategy(fl.server.strategy.FaultTolerantFedAvg):
         return aggregated_loss, {"accuracy": aggregated_accuracy}
 
 
+class QuorumServer(fl.server.Server):
+    """Server whose fit rounds close at a quorum or deadline instead of waiting for every client.
+
+    Fit calls still running when a round closes are not cancelled: their results join the next
+    round, where SaveModelStrategy weighs them by staleness.
+    """
+
+    def __init__(self, *, client_manager: ClientManager, strategy: SaveModelStrategy,
+                 quorum: float = QUORUM, deadline: float = ROUND_DEADLINE):
+        super().__init__(client_manager=client_manager, strategy=strategy)
+        self.quorum = quorum
+        self.deadline = deadline or None
+        self.executor = None
+        self.lock = threading.Lock()
+        # Results that arrived after their round closed
+        self.late: List[Tuple[ClientProxy, FitRes]] = []
+
+    def quorum_size(self, sampled: int) -> int:
+        size = int(np.ceil(self.quorum * sampled)) if self.quorum <= 1 else int(self.quorum)
+        return max(1, min(size, sampled))
+
+    def fit_round(self, server_round: int, timeout: Optional[float]):
+        client_instructions = self.strategy.configure_fit(
+            server_round=server_round, parameters=self.parameters, client_manager=self._client_manager
+        )
+        with self.lock:
+            late, self.late = self.late, []
+        if not client_instructions and not late:
+            log(INFO, "configure_fit: no clients selected, cancel")
+            return None
+
+        # Not a context manager: the round must not wait for stragglers when it closes
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        quorum = self.quorum_size(len(client_instructions))
+        log(INFO, "configure_fit: sampled %s clients, quorum %s", len(client_instructions), quorum)
+
+        start = time.monotonic()
+        pending = set()
+        for proxy, ins in client_instructions:
+            self.strategy.busy_clients.add(proxy.cid)
+            pending.add(self.executor.submit(self.fit_client, proxy, ins, server_round, timeout))
+
+        results, failures = [], []
+        while pending and len(results) < quorum:
+            remaining = None if self.deadline is None else self.deadline - (time.monotonic() - start)
+            if remaining is not None and remaining <= 0:
+                if results or late:
+                    break
+                # Nothing to aggregate yet: keep waiting for the first result
+                remaining = None
+            done, pending = concurrent.futures.wait(
+                pending, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                proxy, res, seconds = future.result()
+                if isinstance(res, BaseException) or res.status.code != Code.OK:
+                    failures.append(res if isinstance(res, BaseException) else (proxy, res))
+                    log_latency(server_round, proxy.cid, seconds, "failed")
+                else:
+                    results.append((proxy, res))
+                    log_latency(server_round, proxy.cid, seconds, "on_time")
+
+        for future in pending:
+            future.add_done_callback(self.collect_late)
+        log(INFO, "Round %s closed after %.1fs: %s results, %s late from earlier rounds, %s failures, %s still running",
+            server_round, time.monotonic() - start, len(results), len(late), len(failures), len(pending))
+
+        parameters_aggregated, metrics_aggregated = self.strategy.aggregate_fit(server_round, results + late, failures)
+        return parameters_aggregated, metrics_aggregated, (results + late, failures)
+
+    def fit_client(self, proxy: ClientProxy, ins, server_round: int, timeout: Optional[float]):
+        start = time.monotonic()
+        try:
+            res = proxy.fit(ins, timeout=timeout, group_id=server_round)
+            res.metrics["base_round"] = server_round
+        except Exception as e:
+            res = e
+        finally:
+            self.strategy.busy_clients.discard(proxy.cid)
+        return proxy, res, time.monotonic() - start
+
+    def collect_late(self, future):
+        proxy, res, seconds = future.result()
+        base_round = None if isinstance(res, BaseException) else res.metrics["base_round"]
+        if base_round is None or res.status.code != Code.OK:
+            log_latency(base_round, proxy.cid, seconds, "failed")
+            return
+        log_latency(base_round, proxy.cid, seconds, "late")
+        with self.lock:
+            self.late.append((proxy, res))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_latency_lock = threading.Lock()
+
+
+def log_latency(server_round, cid, seconds, status):
+    """Append one client fit to results/client_latency.csv."""
+    with _latency_lock:
+        os.makedirs("results", exist_ok=True)
+        new_file = not os.path.exists("results/client_latency.csv")
+        with open("results/client_latency.csv", "a") as f:
+            if new_file:
+                f.write("round,cid,seconds,status\n")
+            f.write(f"{server_round if server_round is not None else ''},{cid},{seconds:.3f},{status}\n")
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="FL")
     parser.add_argument("--clients", default=3, type=int)
     parser.add_argument("--rounds", default=3, type=int)
     parser.add_argument("--fraction", default=1.0, type=float)
     parser.add_argument("--address",type=str,required=True,help=f"String of the gRPC server address in the format 127.0.0.1:8080")
+    parser.add_argument("--compression", default=COMPRESSION, choices=compression.MODES,
+                        help="Quantization applied by clients to their weight updates")
+    parser.add_argument("--delta", action="store_true", default=DELTA,
+                        help="Clients send the difference to the round's global weights")
+    parser.add_argument("--quorum", default=QUORUM, type=float,
+                        help="Results that close a fit round: fraction of sampled clients (<= 1) or a count")
+    parser.add_argument("--deadline", default=ROUND_DEADLINE, type=float,
+                        help="Seconds after which a fit round closes with the results it has (0 disables)")
+    parser.add_argument("--client-timeout", default=CLIENT_TIMEOUT, type=float,
+                        help="Timeout of a single client call in seconds (0 waits indefinitely)")
     args = parser.parse_args()
 
     # Load and compile model for
@@ -96,31 +308,52 @@ def main() -> None:
     model.summary()
 
     # Create strategy
-    strategy = fl.server.strategy.FedAvg(
+    strategy = SaveModelStrategy(
         fraction_fit=args.fraction,
         fraction_evaluate=args.fraction,
         min_fit_clients=args.clients,
         min_evaluate_clients=args.clients,
         min_available_clients=args.clients,
         evaluate_fn=get_evaluate_fn(model),
-        on_fit_config_fn=fit_config,
+        on_fit_config_fn=lambda server_round: {
+            **fit_config(server_round), "compression": args.compression, "delta": args.delta
+        },
         on_evaluate_config_fn=evaluate_config,
         initial_parameters=fl.common.ndarrays_to_parameters(model.get_weights()),
     )
 
     # Start Flower server (SSL-enabled) for four rounds of federated learning
+    # Clients left behind by the quorum keep training and are folded into the next round
+    server = QuorumServer(
+        client_manager=SimpleClientManager(), strategy=strategy, quorum=args.quorum, deadline=args.deadline
+    )
     fl.server.start_server(
         server_address=args.address,
-        config=fl.server.ServerConfig(num_rounds=args.rounds),
-        strategy=strategy,
+        server=server,
+        config=fl.server.ServerConfig(num_rounds=args.rounds, round_timeout=args.client_timeout or None),
         certificates=(
             Path(".cache/certificates/ca.crt").read_bytes(),
             Path(".cache/certificates/server.pem").read_bytes(),
             Path(".cache/certificates/server.key").read_bytes(),
         ),
     )
+    server.shutdown()
 
-    model.save('models/saved_model.keras')
+    save_model(model)
+
+
+def save_model(model):
+    """Deploy the trained model and its preprocessing artifacts for the classifier's hot reload.
+
+    The model is written to a temporary file and renamed into place, so a reload never reads a partial file.
+    """
+    os.makedirs(os.path.dirname(MODEL_PATH) or ".", exist_ok=True)
+    tmp = os.path.splitext(MODEL_PATH)[0] + ".tmp.keras"
+    model.save(tmp)
+    # The prepared dataset is cached, so this only re-exports the artifacts fitted for the evaluation data
+    client.load_partition(preprocessing_path=PREPROCESSING_PATH)
+    os.replace(tmp, MODEL_PATH)
+    print(f"Model saved to {MODEL_PATH}")
 
 
 def get_evaluate_fn(model):
@@ -132,6 +365,7 @@ def get_evaluate_fn(model):
     # test.set_format("numpy")
     # x_test, y_test = test["img"] / 255.0, test["label"]
 
+    # The fitted scaler/vocabularies are exported with the trained model (save_model), not before training
     _, _, x_val, y_val = client.load_partition()
     with open('results/class.txt', 'w') as f:
         for line in y_val:
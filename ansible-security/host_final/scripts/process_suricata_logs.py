@@ -1,85 +1,672 @@
-from pyspark import SparkConf
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, hour, minute, second, to_timestamp
-from pyspark.sql.types import StructType, StringType, IntegerType, StructField
+import argparse
+import csv
+import fcntl
+import glob
+import io
+import json
 import os
+import re
+import signal
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
 
 # Garante que não tenha variável externa influenciando
 # Remove qualquer variável de ambiente que possa estar configurando o Spark em modo cluster
 for var in ["SPARK_MASTER", "SPARK_HOME", "PYSPARK_SUBMIT_ARGS", "PYSPARK_DRIVER_PYTHON_OPTS"]:
     os.environ.pop(var, None)
 
-spark = SparkSession.builder \
-    .appName("SuricataLogProcessor") \
-    .master("local[*]") \
-    .config("spark.driver.bindAddress", "127.0.0.1") \
-    .config("spark.driver.host", "127.0.0.1") \
-    .config("spark.jars", "/opt/spark/jars/postgresql.jar") \
-    .getOrCreate()
-
-
-suricata_log_path = "/var/log/suricata/eve.json"
-
-# Schema customizado
-schema = StructType([
-    StructField("timestamp", StringType(), True),
-    StructField("event_type", StringType(), True),
-    StructField("flow_id", StringType(), True),
-    StructField("src_ip", StringType(), True),
-    StructField("src_port", IntegerType(), True),
-    StructField("dest_ip", StringType(), True),
-    StructField("dest_port", IntegerType(), True),
-    StructField("proto", StringType(), True),
-    StructField("alert", StructType([
-        StructField("severity", IntegerType(), True)
-    ])),
-    StructField("flow", StructType([
-        StructField("pkts_toserver", IntegerType(), True),
-        StructField("pkts_toclient", IntegerType(), True),
-        StructField("bytes_toserver", IntegerType(), True),
-        StructField("bytes_toclient", IntegerType(), True)
-    ]))
-])
-
-# Lê todos os eventos, deixando o Spark inferir o schema
-df_raw = spark.read.option("mode", "PERMISSIVE").json(suricata_log_path)
-
-# Normaliza os campos para o schema desejado
-df_final = df_raw.select(
-    col("flow_id"),
-    col("src_ip"),
-    col("dest_ip"),
-    col("src_port"),
-    col("dest_port"),
-    col("proto"),
-    to_timestamp("timestamp").alias("ts"),
-    col("alert.severity").alias("severity"),  # Pode ser null se não for um alerta
-    col("flow.pkts_toserver").alias("pkts_toserver"),
-    col("flow.pkts_toclient").alias("pkts_toclient"),
-    col("flow.bytes_toserver").alias("bytes_toserver"),
-    col("flow.bytes_toclient").alias("bytes_toclient")
-).withColumn("hour", hour("ts")) \
- .withColumn("minute", minute("ts")) \
- .withColumn("seconds", second("ts")) \
- .drop("ts")
-
-df_final = df_final.fillna(0) # Preenche valores nulos com 0
-# Reorganiza
-df_final = df_final.select(
+suricata_log_path = os.getenv("SURICATA_LOG_PATH", "/var/log/suricata/eve.json")
+
+# Checkpoint (inode + offset em bytes) do último trecho do eve.json já gravado no banco
+CHECKPOINT_PATH = os.getenv("INGEST_CHECKPOINT_PATH", "/var/lib/suricata_ingest/eve.checkpoint.json")
+LOCK_PATH = CHECKPOINT_PATH + ".lock"
+# Fluxos ainda pendentes na agregação do modo stream: arquivo separado, gravado a cada
+# PENDENTES_INTERVALO segundos e ao encerrar (o checkpoint do offset continua a cada flush).
+# Após uma queda, até PENDENTES_INTERVALO segundos de mudanças nos pendentes se perdem ou são
+# repetidas; o modo Spark não agrega e deixa o arquivo intacto para a volta ao modo stream
+PENDENTES_PATH = CHECKPOINT_PATH + ".pendentes"
+PENDENTES_INTERVALO = float(os.getenv("INGEST_PENDENTES_INTERVALO", 60))
+# Quantidade máxima de bytes lidos por bloco; blocos maiores são processados em várias passadas
+MAX_BYTES_POR_BLOCO = int(os.getenv("INGEST_MAX_BYTES", 256 * 1024 * 1024))
+
+# Tipos de evento do eve.json que viram linhas em trafego (vazio = todos)
+EVENT_TYPES = [t.strip() for t in os.getenv("INGEST_EVENT_TYPES", "alert,flow").split(",") if t.strip()]
+
+# Modo stream: tamanho máximo do lote enviado via COPY e intervalo máximo entre flushes
+STREAM_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 5000))
+STREAM_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", 2.0))
+STREAM_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", 0.5))
+STREAM_MAX_BYTES = int(os.getenv("INGEST_STREAM_MAX_BYTES", 4 * 1024 * 1024))
+
+# Agregação por flow_id: eventos do mesmo fluxo dentro da janela (segundos) viram uma única linha
+# em trafego (0 = uma linha por evento). No modo stream, o evento "flow" (fim do fluxo) emite a
+# linha na hora; fluxos sem ele são emitidos ao fim da janela ou quando há fluxos pendentes demais
+AGREGACAO_JANELA = float(os.getenv("INGEST_AGREGACAO_JANELA", 60))
+AGREGACAO_MAX_FLUXOS = int(os.getenv("INGEST_AGREGACAO_MAX_FLUXOS", 200000))
+
+# Cópia opcional em Parquet (diretório particionado por data=AAAA-MM-DD) para backfills e benchmarks
+# offline. No modo stream as linhas são acumuladas e gravadas em arquivos de até PARQUET_MAX_LINHAS
+# ou a cada PARQUET_INTERVALO segundos; a cópia é feita após o commit no banco. As linhas não têm
+# rótulo (class), então não servem para treino sem uma etapa de rotulagem
+PARQUET_DIR = os.getenv("INGEST_PARQUET_DIR", "")
+PARQUET_MAX_LINHAS = int(os.getenv("INGEST_PARQUET_MAX_LINHAS", 500000))
+PARQUET_INTERVALO = float(os.getenv("INGEST_PARQUET_INTERVALO", 300))
+
+DB_HOST = os.getenv("DB_HOST", "192.168.15.8")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", "nids_db")
+DB_USER = os.getenv("DB_USER", "user")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
+
+COLUNAS_TRAFEGO = [
     "flow_id", "src_ip", "dest_ip", "src_port", "dest_port", "proto",
     "hour", "minute", "seconds", "severity",
     "pkts_toserver", "pkts_toclient", "bytes_toserver", "bytes_toclient"
-)
+]
+COLUNAS_CONTADORES = ["pkts_toserver", "pkts_toclient", "bytes_toserver", "bytes_toclient"]
 
 # Configuração JDBC
-pg_url = "jdbc:postgresql://192.168.15.8:5432/nids_db"
+pg_url = f"jdbc:postgresql://{DB_HOST}:{DB_PORT}/{DB_NAME}"
 pg_properties = {
-    "user": "user",
-    "password": "password",
+    "user": DB_USER,
+    "password": DB_PASSWORD,
     "driver": "org.postgresql.Driver"
 }
 
-# Escreve no PostgreSQL
-df_final.write.jdbc(url=pg_url, table="trafego", mode="append", properties=pg_properties)
 
-spark.stop()
+def schema_eve():
+    """Schema customizado dos eventos do eve.json lidos pelo Spark"""
+    from pyspark.sql.types import StructType, StringType, IntegerType, StructField
+
+    return StructType([
+        StructField("timestamp", StringType(), True),
+        StructField("event_type", StringType(), True),
+        StructField("flow_id", StringType(), True),
+        StructField("src_ip", StringType(), True),
+        StructField("src_port", IntegerType(), True),
+        StructField("dest_ip", StringType(), True),
+        StructField("dest_port", IntegerType(), True),
+        StructField("proto", StringType(), True),
+        StructField("alert", StructType([
+            StructField("severity", IntegerType(), True)
+        ])),
+        StructField("flow", StructType([
+            StructField("pkts_toserver", IntegerType(), True),
+            StructField("pkts_toclient", IntegerType(), True),
+            StructField("bytes_toserver", IntegerType(), True),
+            StructField("bytes_toclient", IntegerType(), True)
+        ]))
+    ])
+
+
+def carregar_checkpoint(caminho=CHECKPOINT_PATH):
+    """Lê o checkpoint salvo; retorna um checkpoint vazio se ainda não existir"""
+    try:
+        with open(caminho, "r") as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"inode": None, "offset": 0}
+    # Versões anteriores guardavam os pendentes junto com o offset: passam para PENDENTES_PATH,
+    # para que nenhum dos modos os descarte ao regravar o checkpoint
+    pendentes = checkpoint.pop("pendentes", None)
+    if pendentes is not None and not os.path.exists(PENDENTES_PATH):
+        salvar_checkpoint(pendentes, PENDENTES_PATH)
+    return checkpoint
+
+
+def salvar_checkpoint(checkpoint, caminho=CHECKPOINT_PATH):
+    """Grava o checkpoint de forma atômica (arquivo temporário + rename)"""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = caminho + ".tmp"
+    with open(temporario, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+
+
+def carregar_pendentes(caminho=PENDENTES_PATH):
+    """Lê os fluxos pendentes salvos pelo modo stream; None se não houver"""
+    try:
+        with open(caminho, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def localizar_rotacionado(log_path, inode):
+    """Procura o arquivo rotacionado (eve.json.1, ...) que ainda tem o inode do checkpoint"""
+    for candidato in sorted(glob.glob(log_path + ".*")):
+        try:
+            if os.stat(candidato).st_ino == inode:
+                return candidato
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def ler_bloco(caminho, offset, max_bytes=MAX_BYTES_POR_BLOCO):
+    """Lê a partir de offset até a última linha completa; retorna (linhas, novo_offset)"""
+    with open(caminho, "rb") as f:
+        f.seek(offset)
+        dados = f.read(max_bytes)
+    fim = dados.rfind(b"\n")
+    if fim < 0:
+        # Nenhuma linha completa ainda (Suricata pode estar no meio da escrita)
+        return [], offset
+    linhas = [linha for linha in dados[:fim].split(b"\n") if linha.strip()]
+    return linhas, offset + fim + 1
+
+
+def proximo_bloco(log_path, checkpoint, max_bytes=MAX_BYTES_POR_BLOCO):
+    """
+    Retorna (linhas, novo_checkpoint) com os eventos escritos desde o checkpoint.
+    Se o eve.json foi rotacionado, termina primeiro de ler o arquivo antigo
+    (localizado pelo inode) e só então passa a ler o arquivo novo do início.
+    """
+    st = os.stat(log_path)
+    inode, offset = checkpoint.get("inode"), checkpoint.get("offset", 0)
+
+    if inode is None:
+        inode, offset = st.st_ino, 0
+    elif inode != st.st_ino:
+        rotacionado = localizar_rotacionado(log_path, inode)
+        if rotacionado:
+            linhas, novo_offset = ler_bloco(rotacionado, offset, max_bytes)
+            if linhas:
+                return linhas, {"inode": inode, "offset": novo_offset}
+        inode, offset = st.st_ino, 0
+    elif st.st_size < offset:
+        # Arquivo truncado no lugar (copytruncate)
+        offset = 0
+
+    linhas, novo_offset = ler_bloco(log_path, offset, max_bytes)
+    return linhas, {"inode": inode, "offset": novo_offset}
+
+
+def criar_sessao_spark():
+    from pyspark.sql import SparkSession
+
+    return SparkSession.builder \
+        .appName("SuricataLogProcessor") \
+        .master("local[*]") \
+        .config("spark.driver.bindAddress", "127.0.0.1") \
+        .config("spark.driver.host", "127.0.0.1") \
+        .config("spark.jars", "/opt/spark/jars/postgresql.jar") \
+        .getOrCreate()
+
+
+def agregar_fluxos(df, janela=AGREGACAO_JANELA):
+    """
+    Uma linha por flow_id e janela de tempo: contadores finais (máximo, pois só crescem), o alerta
+    mais grave e a 5-tupla/horário do primeiro evento (preferindo o evento "flow", que tem a direção do fluxo)
+    """
+    from pyspark.sql import functions as F
+
+    primeiro = F.min(F.struct(
+        (F.col("event_type") != "flow").alias("nao_flow"), "ts", "src_ip", "dest_ip", "src_port", "dest_port", "proto"
+    )).alias("primeiro")
+    return df.groupBy("flow_id", F.window("ts", f"{int(janela)} seconds")).agg(
+        primeiro,
+        F.min("ts").alias("ts"),
+        # No Suricata a severidade 1 é a mais alta; 0/nulo indica evento sem alerta
+        F.min(F.when(F.col("severity") > 0, F.col("severity"))).alias("severity"),
+        *[F.max(c).alias(c) for c in COLUNAS_CONTADORES]
+    ).select(
+        "flow_id", "primeiro.src_ip", "primeiro.dest_ip", "primeiro.src_port", "primeiro.dest_port",
+        "primeiro.proto", "ts", "severity", *COLUNAS_CONTADORES
+    )
+
+
+def normalizar(df_raw, com_data=False):
+    """Projeta os eventos do eve.json nas colunas da tabela trafego (+ coluna data, para o Parquet)"""
+    from pyspark.sql.functions import col, date_format, hour, minute, second, to_timestamp
+
+    if EVENT_TYPES:
+        df_raw = df_raw.filter(col("event_type").isin(EVENT_TYPES))
+
+    df_final = df_raw.select(
+        col("event_type"),
+        col("flow_id"),
+        col("src_ip"),
+        col("dest_ip"),
+        col("src_port"),
+        col("dest_port"),
+        col("proto"),
+        to_timestamp("timestamp").alias("ts"),
+        col("alert.severity").alias("severity"),  # Pode ser null se não for um alerta
+        col("flow.pkts_toserver").alias("pkts_toserver"),
+        col("flow.pkts_toclient").alias("pkts_toclient"),
+        col("flow.bytes_toserver").alias("bytes_toserver"),
+        col("flow.bytes_toclient").alias("bytes_toclient")
+    )
+    if AGREGACAO_JANELA > 0:
+        df_final = agregar_fluxos(df_final)
+
+    df_final = df_final.withColumn("hour", hour("ts")) \
+     .withColumn("minute", minute("ts")) \
+     .withColumn("seconds", second("ts")) \
+     .withColumn("data", date_format("ts", "yyyy-MM-dd")) \
+     .drop("ts")
+
+    df_final = df_final.fillna(0) # Preenche valores nulos com 0
+    # Reorganiza
+    return df_final.select(*COLUNAS_TRAFEGO, *(["data"] if com_data else []))
+
+
+def gravar(df, destino_banco=True, parquet_dir=PARQUET_DIR):
+    """Grava o DataFrame normalizado (com a coluna data) no banco e/ou no Parquet particionado por data"""
+    if not parquet_dir:
+        df.drop("data").write.jdbc(url=pg_url, table="trafego", mode="append", properties=pg_properties)
+        return
+
+    df = df.cache()
+    try:
+        if not destino_banco:
+            df.write.partitionBy("data").mode("append").parquet(parquet_dir)
+            return
+        df.drop("data").write.jdbc(url=pg_url, table="trafego", mode="append", properties=pg_properties)
+        # Com o banco como destino, a cópia em Parquet é secundária: uma falha aqui não pode
+        # impedir o checkpoint de avançar (o lote seria gravado de novo no banco)
+        try:
+            df.write.partitionBy("data").mode("append").parquet(parquet_dir)
+        except Exception as e:
+            print(f"[Ingest] Erro ao copiar lote para Parquet em {parquet_dir}: {e}")
+    finally:
+        df.unpersist()
+
+
+def processar_incremental(log_path=suricata_log_path, destino_banco=True, parquet_dir=PARQUET_DIR):
+    """Grava no banco apenas os eventos novos desde o último checkpoint"""
+    if not os.path.exists(log_path):
+        print(f"[Ingest] {log_path} não encontrado. Nada a processar.")
+        return
+
+    checkpoint = carregar_checkpoint()
+    spark = None
+    try:
+        while True:
+            linhas, novo_checkpoint = proximo_bloco(log_path, checkpoint)
+            if not linhas:
+                if novo_checkpoint != checkpoint:
+                    salvar_checkpoint(novo_checkpoint)
+                break
+
+            # A JVM só sobe quando há eventos novos para processar
+            if spark is None:
+                spark = criar_sessao_spark()
+
+            eventos = spark.sparkContext.parallelize([linha.decode("utf-8", "replace") for linha in linhas])
+            df_raw = spark.read.schema(schema_eve()).option("mode", "PERMISSIVE").json(eventos)
+            gravar(normalizar(df_raw, com_data=True), destino_banco, parquet_dir)
+
+            # Checkpoint só avança depois da escrita confirmada no banco
+            salvar_checkpoint(novo_checkpoint)
+            print(f"[Ingest] {len(linhas)} eventos gravados (offset {novo_checkpoint['offset']}).")
+            checkpoint = novo_checkpoint
+    finally:
+        if spark is not None:
+            spark.stop()
+
+
+def processar_backfill(caminhos, destino_banco=True, parquet_dir=PARQUET_DIR):
+    """Carga em massa com Spark de arquivos inteiros (sem checkpoint), para reprocessamentos"""
+    spark = criar_sessao_spark()
+    try:
+        df_raw = spark.read.schema(schema_eve()).option("mode", "PERMISSIVE").json(caminhos)
+        gravar(normalizar(df_raw, com_data=True), destino_banco, parquet_dir)
+        print(f"[Ingest] Backfill concluído: {', '.join(caminhos)}")
+    finally:
+        spark.stop()
+
+
+# ---------------------------------------------------------------------------
+# Modo stream: processo contínuo em Python puro, sem JVM
+# ---------------------------------------------------------------------------
+
+_FILTRO_EVENTO = re.compile(
+    rb'"event_type"\s*:\s*"(' + b"|".join(re.escape(t.encode()) for t in EVENT_TYPES) + rb')"'
+) if EVENT_TYPES else None
+
+INT32_MAX = 2**31 - 1
+
+
+def _inteiro(valor):
+    """Converte como o IntegerType do Spark: ausente, inválido ou fora de int32 vira 0"""
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        return 0
+    valor = int(valor)
+    return valor if -INT32_MAX - 1 <= valor <= INT32_MAX else 0
+
+
+def decodificar_evento(linha):
+    """Faz o parsing de uma linha do eve.json; None se for inválida ou de um tipo não ingerido"""
+    # Descarta tipos de evento indesejados antes de fazer o parsing do JSON
+    if _FILTRO_EVENTO is not None and not _FILTRO_EVENTO.search(linha):
+        return None
+    try:
+        evento = json.loads(linha)
+    except ValueError:
+        return None
+    if not isinstance(evento, dict) or (EVENT_TYPES and evento.get("event_type") not in EVENT_TYPES):
+        return None
+    return evento
+
+
+def registro_do_evento(evento):
+    """
+    Converte um evento do eve.json em uma tupla com as colunas de trafego seguidas da data
+    do evento (usada só para particionar o Parquet), ou None
+    """
+    flow_id = evento.get("flow_id")
+    src_ip, dest_ip, proto = evento.get("src_ip"), evento.get("dest_ip"), evento.get("proto")
+    if flow_id is None or src_ip is None or dest_ip is None or proto is None:
+        return None
+
+    hora = minuto = segundos = 0
+    data = None
+    try:
+        # Mesmo comportamento do to_timestamp do Spark: horário local do host
+        ts = datetime.strptime(evento["timestamp"], "%Y-%m-%dT%H:%M:%S.%f%z").astimezone()
+        hora, minuto, segundos = ts.hour, ts.minute, ts.second
+        data = ts.strftime("%Y-%m-%d")
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    alert = evento.get("alert") or {}
+    flow = evento.get("flow") or {}
+    return (
+        str(flow_id), src_ip, dest_ip,
+        _inteiro(evento.get("src_port")), _inteiro(evento.get("dest_port")), proto,
+        hora, minuto, segundos, _inteiro(alert.get("severity")),
+        _inteiro(flow.get("pkts_toserver")), _inteiro(flow.get("pkts_toclient")),
+        _inteiro(flow.get("bytes_toserver")), _inteiro(flow.get("bytes_toclient")),
+        data,
+    )
+
+
+def normalizar_evento(linha):
+    """Converte uma linha do eve.json em uma tupla com as colunas de trafego (ou None)"""
+    evento = decodificar_evento(linha)
+    return registro_do_evento(evento) if evento is not None else None
+
+
+_IDX_SEVERITY = COLUNAS_TRAFEGO.index("severity")
+_IDX_CONTADORES = [COLUNAS_TRAFEGO.index(c) for c in COLUNAS_CONTADORES]
+
+
+class AgregadorFluxos:
+    """
+    Junta os eventos de um mesmo flow_id em uma única linha de trafego: contadores finais (máximo),
+    o alerta mais grave (menor severidade não nula; no Suricata 1 é a mais alta) e a 5-tupla do
+    evento "flow" quando ele chega. Os fluxos pendentes ficam em ordem de chegada, e o estado
+    é serializável para ser salvo em PENDENTES_PATH. Reaplicar um evento já incorporado não
+    muda a linha (máximo dos contadores, menor severidade).
+    """
+
+    def __init__(self, janela=AGREGACAO_JANELA, max_fluxos=AGREGACAO_MAX_FLUXOS, pendentes=None):
+        self.janela = janela
+        self.max_fluxos = max_fluxos
+        # flow_id -> [visto_em (epoch do primeiro evento), linha]
+        self.fluxos = OrderedDict()
+        for visto_em, linha in pendentes or []:
+            self.fluxos[linha[0]] = [visto_em, linha]
+
+    def __len__(self):
+        return len(self.fluxos)
+
+    @staticmethod
+    def _mesclar(linha, registro, final):
+        if final:
+            # O evento "flow" traz a direção real do fluxo (alertas usam a do pacote)
+            linha[1:6] = registro[1:6]
+        severidades = [s for s in (linha[_IDX_SEVERITY], registro[_IDX_SEVERITY]) if s > 0]
+        linha[_IDX_SEVERITY] = min(severidades) if severidades else 0
+        for i in _IDX_CONTADORES:
+            linha[i] = max(linha[i], registro[i])
+
+    def adicionar(self, tipo, registro, agora):
+        """Incorpora um evento; retorna as linhas que ficaram prontas para gravar"""
+        final = tipo == "flow"
+        pendente = self.fluxos.pop(registro[0], None) if final else self.fluxos.get(registro[0])
+        if pendente is None:
+            linha = list(registro)
+            if not final:
+                self.fluxos[registro[0]] = [agora, linha]
+        else:
+            linha = pendente[1]
+            self._mesclar(linha, registro, final)
+
+        prontas = [tuple(linha)] if final else []
+        while len(self.fluxos) > self.max_fluxos:
+            prontas.append(tuple(self.fluxos.popitem(last=False)[1][1]))
+        return prontas
+
+    def expirar(self, agora):
+        """Emite os fluxos cuja janela terminou sem o evento de fim (flow)"""
+        prontas = []
+        while self.fluxos:
+            visto_em, linha = next(iter(self.fluxos.values()))
+            if agora - visto_em < self.janela:
+                break
+            self.fluxos.popitem(last=False)
+            prontas.append(tuple(linha))
+        return prontas
+
+    def estado(self):
+        return [[visto_em, linha] for visto_em, linha in self.fluxos.values()]
+
+
+def conectar_banco():
+    import psycopg2
+
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+
+def copiar_linhas(conn, linhas, tabela="trafego"):
+    """Envia as linhas ao PostgreSQL com COPY FROM STDIN, em uma única transação"""
+    n_colunas = len(COLUNAS_TRAFEGO)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(linha[:n_colunas] for linha in linhas)
+    buffer.seek(0)
+    with conn.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {tabela} ({', '.join(COLUNAS_TRAFEGO)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    conn.commit()
+
+
+def schema_parquet():
+    """Mesmos tipos que o Spark grava: texto e int32"""
+    import pyarrow as pa
+
+    texto = {"flow_id", "src_ip", "dest_ip", "proto"}
+    return pa.schema([(c, pa.string() if c in texto else pa.int32()) for c in COLUNAS_TRAFEGO])
+
+
+class EscritorParquet:
+    """Acumula as linhas já gravadas no banco e as grava em arquivos Parquet por data"""
+
+    def __init__(self, diretorio, max_linhas=PARQUET_MAX_LINHAS, intervalo=PARQUET_INTERVALO):
+        import pyarrow  # noqa: F401  (falha já na inicialização se o pyarrow não estiver instalado)
+
+        self.diretorio = diretorio
+        self.max_linhas = max_linhas
+        self.intervalo = intervalo
+        self.linhas = []
+        self.ultima_escrita = time.monotonic()
+
+    def adicionar(self, linhas):
+        self.linhas.extend(linhas)
+        if len(self.linhas) >= self.max_linhas or time.monotonic() - self.ultima_escrita >= self.intervalo:
+            self.descarregar()
+
+    def descarregar(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.ultima_escrita = time.monotonic()
+        if not self.linhas:
+            return
+        n_colunas = len(COLUNAS_TRAFEGO)
+        hoje = datetime.now().strftime("%Y-%m-%d")
+        por_data = {}
+        for linha in self.linhas:
+            por_data.setdefault(linha[n_colunas] or hoje, []).append(linha[:n_colunas])
+
+        schema = schema_parquet()
+        for data, linhas in por_data.items():
+            particao = os.path.join(self.diretorio, f"data={data}")
+            os.makedirs(particao, exist_ok=True)
+            tabela = pa.Table.from_pylist([dict(zip(COLUNAS_TRAFEGO, linha)) for linha in linhas], schema=schema)
+            destino = os.path.join(particao, f"part-{time.time_ns()}-{os.getpid()}.parquet")
+            # Nome temporário oculto: leitores do diretório ignoram arquivos começando com "."
+            temporario = os.path.join(particao, "." + os.path.basename(destino) + ".tmp")
+            pq.write_table(tabela, temporario, compression="zstd")
+            os.replace(temporario, destino)
+        print(f"[Ingest] {len(self.linhas)} linhas copiadas para Parquet em {self.diretorio}.")
+        self.linhas = []
+
+
+def processar_stream(log_path=suricata_log_path, tamanho_lote=STREAM_BATCH_SIZE,
+                     intervalo_flush=STREAM_FLUSH_INTERVAL, intervalo_poll=STREAM_POLL_INTERVAL,
+                     parquet_dir=PARQUET_DIR):
+    """
+    Acompanha o eve.json continuamente (tail) e grava os eventos em lotes via COPY.
+    O checkpoint é o mesmo do modo Spark e só avança após o commit de cada lote; com a
+    agregação ativa, os fluxos ainda pendentes são salvos em PENDENTES_PATH, com menos frequência
+    e ao encerrar, e restaurados ao reiniciar.
+    """
+    import psycopg2
+
+    encerrar = False
+
+    def _sinal(signum, frame):
+        nonlocal encerrar
+        encerrar = True
+
+    signal.signal(signal.SIGTERM, _sinal)
+    signal.signal(signal.SIGINT, _sinal)
+
+    conn = None
+    parquet = EscritorParquet(parquet_dir) if parquet_dir else None
+    checkpoint = carregar_checkpoint()
+    agregador = AgregadorFluxos(pendentes=carregar_pendentes()) if AGREGACAO_JANELA > 0 else None
+    checkpoint_salvo = dict(checkpoint)
+    pendentes_salvos_em = time.monotonic()
+    lote = []
+    ultimo_flush = time.monotonic()
+    print(f"[Ingest] Modo stream iniciado em {log_path} (lote={tamanho_lote}, flush={intervalo_flush}s).")
+
+    while True:
+        linhas = []
+        # Enquanto houver lote pendente, os blocos lidos são pequenos o suficiente para o lote não crescer sem limite
+        if not encerrar and len(lote) < tamanho_lote and os.path.exists(log_path):
+            linhas, checkpoint = proximo_bloco(log_path, checkpoint, STREAM_MAX_BYTES)
+            for linha in linhas:
+                evento = decodificar_evento(linha)
+                registro = registro_do_evento(evento) if evento is not None else None
+                if registro is None:
+                    continue
+                if agregador is None:
+                    lote.append(registro)
+                else:
+                    lote.extend(agregador.adicionar(evento.get("event_type"), registro, time.time()))
+        if agregador is not None:
+            lote.extend(agregador.expirar(time.time()))
+
+        vencido = time.monotonic() - ultimo_flush >= intervalo_flush
+        if (lote or checkpoint != checkpoint_salvo) and (len(lote) >= tamanho_lote or vencido or encerrar):
+            try:
+                if conn is None or conn.closed:
+                    conn = conectar_banco()
+                for i in range(0, len(lote), tamanho_lote):
+                    copiar_linhas(conn, lote[i:i + tamanho_lote])
+            except psycopg2.Error as e:
+                # Mantém o lote e o checkpoint antigo; tenta novamente no próximo ciclo
+                print(f"[Ingest] Erro ao gravar lote ({len(lote)} linhas): {e}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+                if encerrar:
+                    break
+                time.sleep(5)
+                continue
+            salvar_checkpoint(checkpoint)
+            if agregador is not None and time.monotonic() - pendentes_salvos_em >= PENDENTES_INTERVALO:
+                salvar_checkpoint(agregador.estado(), PENDENTES_PATH)
+                pendentes_salvos_em = time.monotonic()
+            if lote:
+                pendentes = f", {len(agregador)} fluxos pendentes" if agregador is not None else ""
+                print(f"[Ingest] {len(lote)} linhas gravadas (offset {checkpoint['offset']}{pendentes}).")
+                if parquet is not None:
+                    # Cópia secundária, feita depois do commit e do checkpoint: falhas só são registradas
+                    try:
+                        parquet.adicionar(lote)
+                    except Exception as e:
+                        print(f"[Ingest] Erro ao copiar lote para Parquet em {parquet_dir}: {e}")
+                        parquet.linhas = []
+            checkpoint_salvo = dict(checkpoint)
+            lote = []
+            ultimo_flush = time.monotonic()
+
+        if encerrar:
+            break
+        if not linhas:
+            time.sleep(intervalo_poll)
+
+    if agregador is not None:
+        # Mesmo se o último lote falhou: os eventos após o checkpoint são relidos e reaplicados sem efeito
+        salvar_checkpoint(agregador.estado(), PENDENTES_PATH)
+    if parquet is not None:
+        try:
+            parquet.descarregar()
+        except Exception as e:
+            print(f"[Ingest] Erro ao copiar lote para Parquet em {parquet_dir}: {e}")
+    if conn is not None:
+        conn.close()
+    print("[Ingest] Modo stream encerrado.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestão do eve.json do Suricata na tabela trafego")
+    parser.add_argument("--modo", choices=["spark", "stream"], default="spark",
+                        help="spark: execução incremental pelo timer; stream: processo contínuo sem JVM")
+    parser.add_argument("--backfill", nargs="+", metavar="ARQUIVO",
+                        help="Carrega arquivos inteiros com Spark, ignorando o checkpoint")
+    parser.add_argument("--parquet", default=PARQUET_DIR, metavar="DIRETORIO",
+                        help="Também grava as linhas normalizadas em Parquet particionado por data")
+    parser.add_argument("--sem-banco", action="store_true",
+                        help="Não grava no banco (útil com --parquet em backfills para benchmarks)")
+    args = parser.parse_args()
+    if args.sem_banco and not args.parquet:
+        parser.error("--sem-banco exige --parquet")
+    if args.sem_banco and args.modo == "stream" and not args.backfill:
+        # No modo stream o Parquet é acumulado em memória e não acompanha o checkpoint
+        parser.error("--sem-banco não é suportado no modo stream")
+    destino_banco = not args.sem_banco
+
+    if args.backfill:
+        processar_backfill(args.backfill, destino_banco, args.parquet)
+        return
+
+    os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+    with open(LOCK_PATH, "w") as lock:
+        # Evita que duas execuções (timer/cron ou stream) leiam o mesmo trecho ao mesmo tempo
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("[Ingest] Outra execução em andamento. Encerrando.")
+            sys.exit(0)
+        if args.modo == "stream":
+            processar_stream(parquet_dir=args.parquet)
+        else:
+            processar_incremental(destino_banco=destino_banco, parquet_dir=args.parquet)
+
+
+if __name__ == "__main__":
+    main()
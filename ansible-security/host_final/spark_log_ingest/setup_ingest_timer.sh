@@ -4,6 +4,25 @@ SERVICE_DIR="/etc/systemd/system"
 TARGET_DIR="/opt/spark_log_ingest"
 SCRIPT_DIR="/opt/scripts"
 CRON_JOB="*/1 * * * * /usr/bin/python3 $SCRIPT_DIR/process_suricata_logs.py >> /var/log/suricata_ingest.log 2>&1"
+# spark: timer executando o Spark a cada minuto | stream: processo contínuo em Python puro
+INGEST_MODO="${INGEST_MODO:-spark}"
+
+if [ "$INGEST_MODO" = "stream" ]; then
+    echo "[INFO] Modo de ingestão stream selecionado."
+    if pidof systemd > /dev/null; then
+        cp "$TARGET_DIR/log_ingest_stream.service" "$SERVICE_DIR/"
+        systemctl daemon-reload
+        systemctl disable --now log_ingest.timer 2>/dev/null || true
+        systemctl enable --now log_ingest_stream.service
+        echo "[OK] Serviço de ingestão contínua habilitado."
+    else
+        echo "[WARN] Systemd não disponível. Iniciando ingestão contínua em segundo plano."
+        (crontab -l 2>/dev/null | grep -v "$SCRIPT_DIR/process_suricata_logs.py") | crontab -
+        nohup /usr/bin/python3 "$SCRIPT_DIR/process_suricata_logs.py" --modo stream >> /var/log/suricata_ingest.log 2>&1 &
+        echo "[OK] Ingestão contínua iniciada."
+    fi
+    exit 0
+fi
 
 echo "[INFO] Verificando se systemd está disponível..."
 if pidof systemd > /dev/null; then
@@ -1,6 +1,6 @@
 import utils
+import http_client
 import sqlite3
-import requests
 import json
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
@@ -9,9 +9,9 @@ import aiohttp
 import asyncio
 
 
-NIDS_URL = "http://172.16.9.105:5050" # API FastAPI NIDS API
-LLM_URL = "http://localhost:8000"  # API FastAPI LLM API
-OLLAMA_URL = "http://localhost:11434"
+NIDS_URL = os.getenv("NIDS_URL", "http://172.16.9.105:5050") # API FastAPI NIDS API
+LLM_URL = os.getenv("LLM_URL", "http://localhost:8000")  # API FastAPI LLM API
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 
 
 CREDENCIAIS = {
@@ -19,43 +19,133 @@ CREDENCIAIS = {
     "api_llm": {"username": "joao", "password": "admin"}
 }
 
-def obter_token(api_name, url):
+def status_do_erro(e):
+    """Status da resposta de erro (ex.: 401 com o token expirado) ou 500 para falhas de rede"""
+    return e.status if isinstance(e, aiohttp.ClientResponseError) else 500
+
+
+async def obter_token(api_name, url):
     """Obtém e retorna um token JWT para uma API específica"""
+    servico = "nids" if api_name == "api_nids" else "llm"
     try:
-        response = requests.post(f"{url}/token", data=CREDENCIAIS[api_name])
-        response.raise_for_status()
-        return response.json()["access_token"]
-    except requests.RequestException as e:
+        async with http_client.sessao(servico).post(f"{url}/token", data=CREDENCIAIS[api_name]) as response:
+            response.raise_for_status()
+            return (await response.json())["access_token"]
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         raise utils.HTTPException(status_code=500, detail=f"Erro ao obter token para {api_name}: {e}")
         
 
-def buscar_classificados(api_name=CREDENCIAIS["api_nids"], url=NIDS_URL, token=None):
+async def buscar_classificados(api_name=CREDENCIAIS["api_nids"], url=NIDS_URL, token=None):
     """Busca dados da API correspondente usando o token e aplica parsing"""
     headers = {"Authorization": f"Bearer {token}"}
 
     try:
-        response = requests.get(f"{url}/dados/ataques/novos", headers=headers)
-        response.raise_for_status()
-        dados_brutos = response.json()["dados"]
+        async with http_client.sessao("nids").get(f"{url}/dados/ataques/novos", headers=headers) as response:
+            response.raise_for_status()
+            dados_brutos = (await response.json())["dados"]
         return utils.parse_ataques(dados_brutos)
-    except requests.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         raise utils.HTTPException(
             status_code=500,
             detail=f"Erro ao buscar dados de {api_name}: {e}"
         )
 
 
-def atualizar_classificado(flow_id,  api_name=CREDENCIAIS["api_nids"], url=NIDS_URL, token=None):
+async def reservar_classificados(limite, duracao=None, consumidor=None, api_name=CREDENCIAIS["api_nids"], url=NIDS_URL, token=None):
+    """Reserva até `limite` ataques não processados para este consumidor e aplica parsing"""
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"limite": limite}
+    if duracao:
+        params["duracao"] = int(duracao)
+    if consumidor:
+        params["consumidor"] = consumidor
+
+    try:
+        async with http_client.sessao("nids").post(f"{url}/dados/ataques/reservar", params=params, headers=headers) as response:
+            response.raise_for_status()
+            dados_brutos = (await response.json())["dados"]
+        return utils.parse_ataques(dados_brutos)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise utils.HTTPException(status_code=status_do_erro(e), detail=f"Erro ao reservar dados de {api_name}: {e}")
+
+
+async def renovar_classificados(flow_ids, duracao=None, consumidor=None, api_name=CREDENCIAIS["api_nids"], url=NIDS_URL, token=None):
+    """Estende a reserva de ataques ainda em processamento; retorna os flow_ids renovados"""
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {}
+    if duracao:
+        params["duracao"] = int(duracao)
+    if consumidor:
+        params["consumidor"] = consumidor
+
+    try:
+        async with http_client.sessao("nids").post(f"{url}/dados/ataques/renovar", json={"flow_ids": list(flow_ids)}, params=params, headers=headers) as response:
+            response.raise_for_status()
+            return (await response.json())["renovados"]
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise utils.HTTPException(status_code=status_do_erro(e), detail=f"Erro ao renovar reservas de {api_name}: {e}")
+
+
+async def liberar_classificados(flow_ids, consumidor=None, api_name=CREDENCIAIS["api_nids"], url=NIDS_URL, token=None):
+    """Devolve à fila ataques reservados que não puderam ser processados"""
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"consumidor": consumidor} if consumidor else None
+
+    try:
+        async with http_client.sessao("nids").post(f"{url}/dados/ataques/liberar", json={"flow_ids": list(flow_ids)}, params=params, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise utils.HTTPException(status_code=status_do_erro(e), detail=f"Erro ao liberar classificados de {api_name}: {e}")
+
+
+async def eventos_classificados(url=NIDS_URL, token=None, timeout_leitura=60):
+    """
+    Assina /dados/ataques/eventos (server-sent events) e gera (evento, dados) a cada aviso.
+    Termina com exceção se a conexão cair ou nada chegar em `timeout_leitura` segundos.
+    """
+    headers = {"Authorization": f"Bearer {token}", "Accept": "text/event-stream"}
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=http_client.TIMEOUT_CONEXAO, sock_read=timeout_leitura)
+
+    async with http_client.sessao("nids").get(f"{url}/dados/ataques/eventos", headers=headers, timeout=timeout) as response:
+        response.raise_for_status()
+        evento, dados = "message", []
+        async for linha in response.content:
+            linha = linha.decode("utf-8").rstrip("\r\n")
+            if not linha:
+                if dados:
+                    yield evento, json.loads("\n".join(dados))
+                evento, dados = "message", []
+            elif linha.startswith("event:"):
+                evento = linha[6:].strip()
+            elif linha.startswith("data:"):
+                dados.append(linha[5:].strip())
+
+
+async def atualizar_classificado(flow_id,  api_name=CREDENCIAIS["api_nids"], url=NIDS_URL, token=None):
     """Atualiza o status do classificado na API correspondente usando o token"""
     headers = {"Authorization": f"Bearer {token}"}
     data = {"flow_id": flow_id}
     
     try:
-        response = requests.put(f"{url}/dados/ataques/processar/{flow_id}", json=data, headers=headers)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        raise utils.HTTPException(status_code=500, detail=f"Erro ao atualizar classificado de {api_name}: {e}")
+        async with http_client.sessao("nids").put(f"{url}/dados/ataques/processar/{flow_id}", json=data, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise utils.HTTPException(status_code=status_do_erro(e), detail=f"Erro ao atualizar classificado de {api_name}: {e}")
+
+
+async def atualizar_classificados(flow_ids, consumidor=None, api_name=CREDENCIAIS["api_nids"], url=NIDS_URL, token=None):
+    """Marca vários classificados como processados em uma única requisição (só os reservados por consumidor, se informado)"""
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"consumidor": consumidor} if consumidor else None
+
+    try:
+        async with http_client.sessao("nids").put(f"{url}/dados/ataques/processar", json={"flow_ids": list(flow_ids)}, params=params, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise utils.HTTPException(status_code=status_do_erro(e), detail=f"Erro ao atualizar classificados de {api_name}: {e}")
 
 
 async def gerar_contexto_para_lote(lote, model, token):
@@ -69,24 +159,22 @@ async def gerar_contexto_para_lote(lote, model, token):
     dados_str = json.dumps(ataques, indent=2, ensure_ascii=False)
     prompt = utils.carregar_prompt_template("/app/prompt_template.txt", dados_str)
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                f"{OLLAMA_URL}/api/generate",
-                json={"model": model, "prompt": prompt, "stream": False},
-                headers={"Authorization": f"Bearer {token}"},
-                timeout=3600
-            ) as resp:
-                if resp.status != 200:
-                    raise utils.HTTPException(status_code=resp.status, detail=f"Erro da LLM: {await resp.text()}")
-                texto = await resp.text()
-                return json.loads(texto)
-        except asyncio.TimeoutError:
-            raise utils.HTTPException(status_code=504, detail="Timeout da LLM")
-        except json.JSONDecodeError as e:
-            raise utils.HTTPException(status_code=500, detail=f"Erro ao processar resposta JSON: {str(e)}")
-        except ValueError as e:
-            raise utils.HTTPException(status_code=422, detail=f"Erro de validação do contexto: {str(e)}")
+    try:
+        async with http_client.sessao("ollama").post(
+            f"{OLLAMA_URL}/api/generate",
+            json={"model": model, "prompt": prompt, "stream": False},
+            headers={"Authorization": f"Bearer {token}"}
+        ) as resp:
+            if resp.status != 200:
+                raise utils.HTTPException(status_code=resp.status, detail=f"Erro da LLM: {await resp.text()}")
+            texto = await resp.text()
+            return json.loads(texto)
+    except asyncio.TimeoutError:
+        raise utils.HTTPException(status_code=504, detail="Timeout da LLM")
+    except json.JSONDecodeError as e:
+        raise utils.HTTPException(status_code=500, detail=f"Erro ao processar resposta JSON: {str(e)}")
+    except ValueError as e:
+        raise utils.HTTPException(status_code=422, detail=f"Erro de validação do contexto: {str(e)}")
 
 
 
@@ -94,8 +182,8 @@ async def gerar_contexto(model, token):
     if not utils.verificar_token_jwt(token):
         raise utils.HTTPException(status_code=401, detail="Token inválido")
 
-    token_nids = obter_token("api_nids", NIDS_URL)
-    classificados = buscar_classificados(token=token_nids)
+    token_nids = await obter_token("api_nids", NIDS_URL)
+    classificados = await buscar_classificados(token=token_nids)
 
     if not classificados:
         raise utils.HTTPException(status_code=404, detail="Nenhum dado classificado encontrado")
@@ -109,24 +197,22 @@ async def gerar_contexto(model, token):
     dados_str = json.dumps(ataques, indent=2, ensure_ascii=False)
     prompt = utils.carregar_prompt_template("/app/prompt_template.txt", dados_str)
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                f"{OLLAMA_URL}/api/generate",
-                json={"model": model, "prompt": prompt, "stream": False, "keep_alive": "0"},
-                headers={"Authorization": f"Bearer {token}"},
-                timeout=3600
-            ) as resp:
-                if resp.status != 200:
-                    raise utils.HTTPException(status_code=resp.status, detail=f"Erro da LLM: {await resp.text()}")
-                texto = await resp.text()
-                return json.loads(texto)
-        except asyncio.TimeoutError:
-            raise utils.HTTPException(status_code=504, detail="Timeout da LLM")
-        except json.JSONDecodeError as e:
-            raise utils.HTTPException(status_code=500, detail=f"Erro ao processar resposta JSON: {str(e)}")
-        except ValueError as e:
-            raise utils.HTTPException(status_code=422, detail=f"Erro de validação do contexto: {str(e)}")
+    try:
+        async with http_client.sessao("ollama").post(
+            f"{OLLAMA_URL}/api/generate",
+            json={"model": model, "prompt": prompt, "stream": False, "keep_alive": "0"},
+            headers={"Authorization": f"Bearer {token}"}
+        ) as resp:
+            if resp.status != 200:
+                raise utils.HTTPException(status_code=resp.status, detail=f"Erro da LLM: {await resp.text()}")
+            texto = await resp.text()
+            return json.loads(texto)
+    except asyncio.TimeoutError:
+        raise utils.HTTPException(status_code=504, detail="Timeout da LLM")
+    except json.JSONDecodeError as e:
+        raise utils.HTTPException(status_code=500, detail=f"Erro ao processar resposta JSON: {str(e)}")
+    except ValueError as e:
+        raise utils.HTTPException(status_code=422, detail=f"Erro de validação do contexto: {str(e)}")
 
 
 
@@ -146,17 +232,17 @@ async def registrar_ataque(contextos, token: str):
     headers = {"Authorization": f"Bearer {token}",
                "Content-Type": "application/json"}
     
-    async with aiohttp.ClientSession() as session:
-        if isinstance(contextos, list):
-            for contexto in contextos:
-                async with session.post(url, headers=headers, json=contexto) as resp:
-                    if resp.status != 200:
-                        erro = await resp.text()
-                        raise Exception(f"Erro ao registrar ataque: {erro}")
-        else:
-            async with session.post(url, headers=headers, json=contextos) as resp:
+    session = http_client.sessao("llm")
+    if isinstance(contextos, list):
+        for contexto in contextos:
+            async with session.post(url, headers=headers, json=contexto) as resp:
                 if resp.status != 200:
                     erro = await resp.text()
                     raise Exception(f"Erro ao registrar ataque: {erro}")
-        print("[Watcher] Ataque registrado com sucesso!")
+    else:
+        async with session.post(url, headers=headers, json=contextos) as resp:
+            if resp.status != 200:
+                erro = await resp.text()
+                raise Exception(f"Erro ao registrar ataque: {erro}")
+    print("[Watcher] Ataque registrado com sucesso!")
     
@@ -0,0 +1,54 @@
+import asyncio
+import os
+import aiohttp
+
+# Uma sessão aiohttp de longa duração por serviço, com pool de conexões keep-alive.
+# Conexões máximas e timeout total (segundos) de cada serviço podem ser ajustados por variáveis
+# de ambiente, ex.: HTTP_NIDS_CONEXOES=10, HTTP_OLLAMA_TIMEOUT=3600
+SERVICOS = {
+    "nids": {"conexoes": 10, "timeout": 30},
+    "llm": {"conexoes": 10, "timeout": 120},
+    # As gerações da LLM podem levar vários minutos
+    "ollama": {"conexoes": 4, "timeout": 3600},
+}
+TIMEOUT_CONEXAO = float(os.getenv("HTTP_TIMEOUT_CONEXAO", "10"))
+
+# servico -> (sessão, event loop em que foi criada)
+_sessoes = {}
+
+
+def configuracao(servico):
+    padrao = SERVICOS[servico]
+    prefixo = f"HTTP_{servico.upper()}_"
+    return {
+        "conexoes": int(os.getenv(prefixo + "CONEXOES", padrao["conexoes"])),
+        "timeout": float(os.getenv(prefixo + "TIMEOUT", padrao["timeout"])),
+    }
+
+
+def sessao(servico) -> aiohttp.ClientSession:
+    """
+    Sessão compartilhada do serviço ("nids", "llm" ou "ollama"), criada no primeiro uso.
+    Uma sessão fica presa ao event loop em que foi criada, então é recriada se o loop mudou.
+    """
+    loop = asyncio.get_running_loop()
+    atual, loop_atual = _sessoes.get(servico, (None, None))
+    if atual is not None and not atual.closed and loop_atual is loop:
+        return atual
+
+    config = configuracao(servico)
+    nova = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=config["conexoes"], keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=config["timeout"], sock_connect=TIMEOUT_CONEXAO),
+    )
+    _sessoes[servico] = (nova, loop)
+    return nova
+
+
+async def fechar():
+    """Fecha todas as sessões (chamado ao encerrar o watcher ou a API)"""
+    sessoes = list(_sessoes.values())
+    _sessoes.clear()
+    for s, _ in sessoes:
+        if not s.closed:
+            await s.close()
@@ -1,8 +1,11 @@
 import utils
+import http_client
 import json
 from passlib.context import CryptContext
-import aiohttp
 import asyncio
+import os
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 
 def gerar_regras_prompt(ataques, IPS_CONFIAVEIS):
     """Gera um prompt dinâmico baseado nos ataques detectados, priorizando os mais críticos."""
@@ -66,11 +69,11 @@ async def gerar_regras(model, token):
     if not utils.verificar_token_jwt(token):
         raise utils.HTTPException(status_code=401, detail="Token inválido")
 
-    # Consulta ataques
+    # Consulta ataques (sqlite bloqueante, fora do event loop)
     query = "SELECT tipo, descricao, detalhes FROM ataques ORDER BY id DESC"
-    ataques = utils.executar_query(query, fetchall=True)
+    ataques = await asyncio.to_thread(utils.executar_query, query, fetchall=True)
     query = "SELECT ip_protegido FROM protegidos"
-    ips_confiaveis = utils.executar_query(query, fetchall=True)
+    ips_confiaveis = await asyncio.to_thread(utils.executar_query, query, fetchall=True)
 
     if not ataques:
         raise utils.HTTPException(status_code=404, detail="Nenhum ataque registrado")
@@ -88,31 +91,29 @@ async def gerar_regras(model, token):
         "Authorization": f"Bearer {token}"
     }
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(
-                f"{utils.OLLAMA_URL}/api/generate",
-                json=payload,
-                headers=headers,
-                timeout=3600
-            ) as resp:
-                if resp.status != 200:
-                    texto = await resp.text()
-                    raise utils.HTTPException(status_code=resp.status, detail=f"Erro da LLM: {texto}")
-
+    try:
+        async with http_client.sessao("ollama").post(
+            f"{OLLAMA_URL}/api/generate",
+            json=payload,
+            headers=headers
+        ) as resp:
+            if resp.status != 200:
                 texto = await resp.text()
-                resultado = json.loads(texto)
+                raise utils.HTTPException(status_code=resp.status, detail=f"Erro da LLM: {texto}")
+
+            texto = await resp.text()
+            resultado = json.loads(texto)
 
-                # Se a LLM respondeu uma lista vazia ou não enviou nada útil
-                if not resultado:
-                    return {"mensagem": "Nenhuma regra foi gerada pelos dados enviados.", "regras": []}
+            # Se a LLM respondeu uma lista vazia ou não enviou nada útil
+            if not resultado:
+                return {"mensagem": "Nenhuma regra foi gerada pelos dados enviados.", "regras": []}
 
-                return resultado
+            return resultado
 
-        except asyncio.TimeoutError:
-            raise utils.HTTPException(status_code=504, detail="Timeout da LLM")
-        except json.JSONDecodeError:
-            raise utils.HTTPException(status_code=500, detail="Erro ao processar resposta da LLM")
+    except asyncio.TimeoutError:
+        raise utils.HTTPException(status_code=504, detail="Timeout da LLM")
+    except json.JSONDecodeError:
+        raise utils.HTTPException(status_code=500, detail="Erro ao processar resposta da LLM")
 
 
 def registrar_regra(tipo: str, descricao: str, comando: str, ataques, token: str = None):
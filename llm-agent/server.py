@@ -10,6 +10,7 @@ from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 import utils
+import http_client
 from contextualizer import gerar_contexto
 from rule_generator import gerar_regras
 from pydantic import BaseModel
@@ -18,6 +19,8 @@ from fastapi import Body
 from fastapi import Query
 from fastapi.responses import FileResponse, PlainTextResponse, JSONResponse
 import tempfile
+import os
+from contextlib import asynccontextmanager
 
 class ModelRequest(BaseModel):
     model: str
@@ -28,8 +31,15 @@ class AtaqueInput(BaseModel):
     detalhes: str
 
 
-app = FastAPI()
-OLLAMA_URL = "http://localhost:11434"
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Fecha as sessões HTTP compartilhadas no desligamento"""
+    yield
+    await http_client.fechar()
+
+
+app = FastAPI(lifespan=lifespan)
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 DB_FILE = "/app/databases/ataques.db"
 
 
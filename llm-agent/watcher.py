@@ -1,88 +1,280 @@
 import asyncio
+import os
+import socket
 import contextualizer
 import rule_generator
 import server
 import utils
 import llm_client
-import aiohttp
+import http_client
+
+# Requisições simultâneas à LLM (contexto + regras); deve acompanhar o OLLAMA_NUM_PARALLEL
+LLM_CONCORRENCIA = int(os.getenv("WATCHER_LLM_CONCORRENCIA", "2"))
+TAMANHO_LOTE = int(os.getenv("WATCHER_TAMANHO_LOTE", "3"))
+# Lotes aguardando contexto; com a fila cheia o watcher para de buscar novos ataques (backpressure)
+FILA_MAX = int(os.getenv("WATCHER_FILA_MAX", str(2 * LLM_CONCORRENCIA)))
+INTERVALO = float(os.getenv("WATCHER_INTERVALO", "5"))
+# Os ataques são reservados no NIDS por RESERVA_DURACAO segundos; réplicas do watcher com
+# WATCHER_ID diferentes dividem os ataques sem duplicidade
+RESERVA_DURACAO = int(os.getenv("WATCHER_RESERVA_DURACAO", "900"))
+# As chamadas à LLM podem passar da reserva (ex.: HTTP_OLLAMA_TIMEOUT=3600): enquanto um lote está no
+# pipeline, suas reservas são renovadas a cada RESERVA_RENOVACAO segundos
+RESERVA_RENOVACAO = float(os.getenv("WATCHER_RESERVA_RENOVACAO", str(RESERVA_DURACAO / 3)))
+CONSUMIDOR = os.getenv("WATCHER_ID", f"{socket.gethostname()}-{os.getpid()}")
+# Com o stream de eventos do NIDS conectado, a busca periódica vira só uma garantia (ex.: reservas
+# expiradas) e acontece a cada INTERVALO_EVENTOS; sem ele, volta a cada INTERVALO
+EVENTOS_HABILITADO = os.getenv("WATCHER_EVENTOS", "1") == "1"
+INTERVALO_EVENTOS = float(os.getenv("WATCHER_INTERVALO_EVENTOS", "60"))
 
 async def esperar_servidor(url, timeout=60):
     print(f"[Watcher] Aguardando o servidor estar online em {url}...")
-    async with aiohttp.ClientSession() as session:
-        for i in range(timeout):
+    session = http_client.sessao("llm")
+    for i in range(timeout):
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    print(f"[Watcher] Servidor online! ({url})")
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(1)
+    raise TimeoutError(f"Servidor {url} não respondeu em {timeout} segundos.")
+
+
+class Pipeline:
+    """
+    Reserva -> contexto -> regras, ligados por filas limitadas.
+    Só são reservados ataques para as vagas livres na fila; os flow_ids em andamento são lembrados
+    para que uma reserva expirada no meio do pipeline não os enfileire de novo.
+    """
+
+    def __init__(self, llm_token, nids_token):
+        self.llm_token = llm_token
+        self.nids_token = nids_token
+        self.llm_semaforo = asyncio.Semaphore(LLM_CONCORRENCIA)
+        self.fila_lotes = asyncio.Queue(maxsize=FILA_MAX)
+        self.fila_regras = asyncio.Queue(maxsize=FILA_MAX)
+        self.em_andamento = set()
+        # Acordado pelos eventos do NIDS para buscar antes do próximo intervalo
+        self.aviso = asyncio.Event()
+        self.eventos_conectado = False
+
+    async def chamar_nids(self, funcao, *args, **kwargs):
+        """Chama a API do NIDS; com o token expirado (401), obtém outro e tenta de novo uma vez"""
+        try:
+            return await funcao(*args, token=self.nids_token, **kwargs)
+        except utils.HTTPException as e:
+            if e.status_code != 401:
+                raise
+        await self.renovar_token_nids()
+        return await funcao(*args, token=self.nids_token, **kwargs)
+
+    async def renovar_token_nids(self):
+        print("[Watcher] Token do NIDS recusado (401), obtendo outro...")
+        self.nids_token = await contextualizer.obter_token("api_nids", contextualizer.NIDS_URL)
+
+    def liberar(self, lote):
+        self.em_andamento.difference_update(ataque["flow_id"] for ataque in lote)
+
+    async def devolver(self, lote):
+        """Lote que falhou: desfaz a reserva para que seja tentado de novo na próxima busca"""
+        self.liberar(lote)
+        try:
+            await self.chamar_nids(
+                contextualizer.liberar_classificados, [ataque["flow_id"] for ataque in lote], consumidor=CONSUMIDOR
+            )
+        except Exception as e:
+            print(f"[Watcher] Erro ao liberar reserva (expira em {RESERVA_DURACAO}s): {e}")
+
+    async def renovar_reservas(self):
+        while True:
+            await asyncio.sleep(RESERVA_RENOVACAO)
+            flow_ids = list(self.em_andamento)
+            if not flow_ids:
+                continue
             try:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        print(f"[Watcher] Servidor online! ({url})")
-                        return
-            except Exception:
-                pass
-            await asyncio.sleep(1)
-        raise TimeoutError(f"Servidor {url} não respondeu em {timeout} segundos.")
+                renovados = await self.chamar_nids(
+                    contextualizer.renovar_classificados, flow_ids, duracao=RESERVA_DURACAO, consumidor=CONSUMIDOR
+                )
+            except Exception as e:
+                print(f"[Watcher] Erro ao renovar reservas: {e}")
+                continue
+            # Os que acabaram de ser marcados como processados também não voltam; o resto expirou
+            perdidos = (set(flow_ids) - set(renovados)) & self.em_andamento
+            if perdidos:
+                print(f"[Watcher] {len(perdidos)} reservas já tinham expirado: {sorted(perdidos)}")
 
-async def verificar_novos_ataques():
-    await esperar_servidor(f"{llm_client.SERVER_URL}/healthcheck")
+    async def esperar_aviso(self):
+        intervalo = INTERVALO_EVENTOS if self.eventos_conectado else INTERVALO
+        try:
+            await asyncio.wait_for(self.aviso.wait(), intervalo)
+        except asyncio.TimeoutError:
+            pass
+        self.aviso.clear()
 
-    watcher_llm_token = contextualizer.obter_token("api_llm", contextualizer.LLM_URL)
-    watcher_nids_token = contextualizer.obter_token("api_nids", contextualizer.NIDS_URL)
+    async def escutar_eventos(self):
+        espera = INTERVALO
+        token_novo = False
+        while True:
+            try:
+                async for evento, dados in contextualizer.eventos_classificados(token=self.nids_token):
+                    if evento == "pronto":
+                        print("[Watcher] Conectado aos eventos do NIDS.")
+                        self.eventos_conectado = True
+                        espera = INTERVALO
+                    elif evento == "ataques":
+                        print(f"[Watcher] Aviso do NIDS: {dados}")
+                    # Inclusive no "pronto": pode ter chegado algo enquanto estava desconectado
+                    self.aviso.set()
+            except Exception as e:
+                self.eventos_conectado = False
+                if contextualizer.status_do_erro(e) == 401 and not token_novo:
+                    # Token expirado: reconecta na hora com um novo; um 401 com o token novo volta à espera
+                    try:
+                        await self.renovar_token_nids()
+                        token_novo = True
+                        continue
+                    except Exception as erro_token:
+                        e = erro_token
+                print(f"[Watcher] Eventos do NIDS indisponíveis, usando busca a cada {INTERVALO}s: {e}")
+            self.eventos_conectado = False
+            await asyncio.sleep(espera)
+            espera = min(espera * 2, INTERVALO_EVENTOS)
+            token_novo = False
 
-    while True:
-        print("[Watcher] Verificando novos ataques...")
-        novos_ataques = contextualizer.buscar_classificados(token=watcher_nids_token)
+    async def buscar(self):
+        while True:
+            vagas = FILA_MAX - self.fila_lotes.qsize()
+            if vagas <= 0:
+                await asyncio.sleep(INTERVALO)
+                continue
 
-        if novos_ataques:
-            print(f"[Watcher] {len(novos_ataques)} novos ataques detectados!")
-            print("[Watcher] Detalhes dos ataques:", novos_ataques)
+            print("[Watcher] Verificando novos ataques...")
+            limite = vagas * TAMANHO_LOTE
+            try:
+                novos_ataques = await self.chamar_nids(
+                    contextualizer.reservar_classificados, limite, duracao=RESERVA_DURACAO, consumidor=CONSUMIDOR
+                )
+            except Exception as e:
+                print(f"[Watcher] Erro ao buscar ataques: {e}")
+                novos_ataques = []
+            cheio = len(novos_ataques) == limite
+
+            novos_ataques = [a for a in novos_ataques if a["flow_id"] not in self.em_andamento]
+            if novos_ataques:
+                print(f"[Watcher] {len(novos_ataques)} novos ataques detectados!")
+                print("[Watcher] Detalhes dos ataques:", novos_ataques)
 
-            lotes = utils.dividir_em_lotes(novos_ataques, tamanho_lote=3)
-            print(f"[Watcher] Fragmentando ataques em {len(lotes)} lotes.")
+                lotes = utils.dividir_em_lotes(novos_ataques, tamanho_lote=TAMANHO_LOTE)
+                print(f"[Watcher] Fragmentando ataques em {len(lotes)} lotes.")
+                for lote in lotes:
+                    self.em_andamento.update(ataque["flow_id"] for ataque in lote)
+                    # Bloqueia enquanto a fila estiver cheia
+                    await self.fila_lotes.put(lote)
 
-            for i, lote in enumerate(lotes):
-                print(f"[Watcher] Processando lote {i+1}/{len(lotes)} com {len(lote)} ataques...")
+            # Reserva cheia: provavelmente há mais ataques esperando, busca de novo sem pausa
+            if not cheio:
+                await self.esperar_aviso()
 
-                try:
-                    print("[Watcher] Gerando contexto...")
+    async def contextualizar(self, worker):
+        while True:
+            lote = await self.fila_lotes.get()
+            print(f"[Watcher] Worker {worker}: processando lote com {len(lote)} ataques...")
+            try:
+                print("[Watcher] Gerando contexto...")
+                async with self.llm_semaforo:
                     contexto = await contextualizer.gerar_contexto_para_lote(
                         lote,
                         model=llm_client.MODEL,
-                        token=watcher_llm_token
+                        token=self.llm_token
                     )
-                    print("[Watcher] Contexto gerado:", contexto)
+                print("[Watcher] Contexto gerado:", contexto)
 
-                    contexto_tratado = utils.extrair_json_de_resposta(contexto)
-                    print("[Watcher] Contexto tratado:", contexto_tratado)
-                    if not contexto_tratado:
-                        print("[Watcher] Contexto vazio ou inválido, pulando lote.")
-                        continue
-                    await contextualizer.registrar_ataque(contexto_tratado, token=watcher_llm_token)
+                contexto_tratado = utils.extrair_json_de_resposta(contexto)
+                print("[Watcher] Contexto tratado:", contexto_tratado)
+                if not contexto_tratado:
+                    print("[Watcher] Contexto vazio ou inválido, pulando lote.")
+                    await self.devolver(lote)
+                    continue
+                await contextualizer.registrar_ataque(contexto_tratado, token=self.llm_token)
+
+                # Segue só o lote: os flow_ids devolvidos pela LLM podem faltar ou vir trocados
+                await self.fila_regras.put(lote)
+            except Exception as e:
+                print(f"[Watcher] Worker {worker}: erro ao processar lote: {e}")
+                await self.devolver(lote)
+            finally:
+                self.fila_lotes.task_done()
+
+    async def gerar_regras(self):
+        while True:
+            lotes = [await self.fila_regras.get()]
+            # gerar_regras considera todos os ataques registrados, então lotes que chegaram
+            # enquanto a LLM estava ocupada são atendidos por uma única chamada
+            while not self.fila_regras.empty():
+                lotes.append(self.fila_regras.get_nowait())
+            # Só os flow_ids reservados nos lotes são associados às regras, marcados e liberados
+            flow_ids = [ataque["flow_id"] for lote in lotes for ataque in lote]
 
-                    print("[Watcher] Gerando regras para o lote...")
+            try:
+                print(f"[Watcher] Gerando regras para {len(lotes)} lotes...")
+                async with self.llm_semaforo:
                     regras = await rule_generator.gerar_regras(
                         model=llm_client.MODEL,
-                        token=watcher_llm_token
+                        token=self.llm_token
+                    )
+                regras_tratadas = utils.extrair_json_de_resposta(regras)
+                print("[Watcher] Regras geradas:", regras_tratadas)
+
+                for regra in regras_tratadas:
+                    await asyncio.to_thread(
+                        rule_generator.registrar_regra,
+                        tipo=regra["tipo"],
+                        descricao=regra["descricao"],
+                        comando=regra["comando"],
+                        ataques=flow_ids,
+                        token=self.llm_token
                     )
-                    regras_tratadas = utils.extrair_json_de_resposta(regras)
-                    print("[Watcher] Regras geradas:", regras_tratadas)
 
-                    flow_ids = [ataque["flow_id"] for ataque in contexto_tratado] if isinstance(contexto_tratado, list) else [contexto_tratado["flow_id"]]
+                print(f"[Watcher] Atualizando {len(flow_ids)} ataques como processados...")
+                await self.chamar_nids(contextualizer.atualizar_classificados, flow_ids, consumidor=CONSUMIDOR)
+                for lote in lotes:
+                    self.liberar(lote)
+            except Exception as e:
+                print(f"[Watcher] Erro ao gerar regras: {e}")
+                for lote in lotes:
+                    await self.devolver(lote)
+            finally:
+                for _ in lotes:
+                    self.fila_regras.task_done()
 
-                    for regra in regras_tratadas:
-                        rule_generator.registrar_regra(
-                            tipo=regra["tipo"],
-                            descricao=regra["descricao"],
-                            comando=regra["comando"],
-                            ataques=flow_ids,
-                            token=watcher_llm_token
-                        )
+    async def executar(self):
+        tarefas = [asyncio.create_task(self.buscar()), asyncio.create_task(self.gerar_regras()),
+                   asyncio.create_task(self.renovar_reservas())]
+        tarefas += [asyncio.create_task(self.contextualizar(i + 1)) for i in range(LLM_CONCORRENCIA)]
+        if EVENTOS_HABILITADO:
+            tarefas.append(asyncio.create_task(self.escutar_eventos()))
+        # Qualquer estágio que termine com exceção derruba o watcher (o container é reiniciado)
+        done, pending = await asyncio.wait(tarefas, return_when=asyncio.FIRST_EXCEPTION)
+        for tarefa in pending:
+            tarefa.cancel()
+        for tarefa in done:
+            tarefa.result()
 
-                    for flow_id in flow_ids:
-                        print(f"[Watcher] Atualizando ataque {flow_id} como processado...")
-                        contextualizer.atualizar_classificado(flow_id, token=watcher_nids_token)
 
-                except Exception as e:
-                    print(f"[Watcher] Erro ao processar lote {i+1}: {e}")
+async def verificar_novos_ataques():
+    if not 0 < RESERVA_RENOVACAO < RESERVA_DURACAO:
+        raise ValueError("WATCHER_RESERVA_RENOVACAO precisa ser maior que zero e menor que WATCHER_RESERVA_DURACAO")
+    try:
+        await esperar_servidor(f"{llm_client.SERVER_URL}/healthcheck")
+
+        watcher_llm_token = await contextualizer.obter_token("api_llm", contextualizer.LLM_URL)
+        watcher_nids_token = await contextualizer.obter_token("api_nids", contextualizer.NIDS_URL)
 
-        await asyncio.sleep(5)
+        print(f"[Watcher] Pipeline com {LLM_CONCORRENCIA} requisições simultâneas à LLM e lotes de {TAMANHO_LOTE}.")
+        await Pipeline(watcher_llm_token, watcher_nids_token).executar()
+    finally:
+        await http_client.fechar()
 
 def iniciar_watcher():
     print("[Watcher] Iniciando monitoramento assíncrono...")